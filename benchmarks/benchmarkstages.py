@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the stages of MixedCrystalSignature on noisy artificial lattices.
+Run from the repository root, e.g.
+
+    python -m benchmarks.benchmarkstages --sizes 1000 10000 100000 --output new.json
+    python -m benchmarks.benchmarkstages --sizes 1000 10000 --compare old.json
+
+Every stage (see MixedCrystalSignature.STAGE_DEPENDENCIES) is timed separately with all
+stages it depends on already calculated. The bond angle and distance histograms are calculated
+in one pass (bond_angle_distance_hists), the stages ba and dist only copy them into the
+signature and are not timed. Mode 'serial' runs the numba kernels on one
+thread, 'threads' on all numba threads and 'pool' times calc_signature_tiled with a
+multiprocessing pool. Peak memory is the additional peak of traced (python and numpy)
+allocations during a stage, in pool mode only the main process is traced.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+import multiprocessing as mp
+import numpy as np
+import numba
+import scipy
+
+import datageneration.generatecrystaldata as gcn
+import datageneration.disordercrystaldata as dcs
+from mixedcrystalsignature import MixedCrystalSignature, warmup
+
+STRUCTURES = {'fcc': gcn.fill_volume_fcc, 'bcc': gcn.fill_volume_bcc, 'hcp': gcn.fill_volume_hcp}
+#particles per unit volume with a nearest neighbour distance of 1
+DENSITIES = {'fcc': np.sqrt(2), 'bcc': 3*np.sqrt(3)/4, 'hcp': np.sqrt(2)}
+MODES = ['serial', 'threads', 'pool']
+#stages that only copy the results of an earlier stage into the signature
+COPY_STAGES = {'ba', 'dist'}
+#methods of stages that are calculated together
+FUSED_METHODS = {'bond_angle_distance_hists': 'calc_bond_angles+calc_hist_distances'}
+
+def make_dataset(size, structure='fcc', noise=0.05, rnd_seed=0):
+    "noisy lattice in a cube with about size particles, returns datapoints and the edge length"
+    side = (size/DENSITIES[structure])**(1/3)
+    datapoints = STRUCTURES[structure](side, side, side)
+    return dcs.GaussianNoiseLevels(datapoints, [noise], rnd_seed)[0], side
+
+def measure(call, traced=False):
+    """wall time of call() and, if traced, the additional peak of traced memory during the call"""
+    if not traced:
+        start = time.perf_counter()
+        call()
+        return time.perf_counter()-start, None
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        call()
+        seconds = time.perf_counter()-start
+        peak = tracemalloc.get_traced_memory()[1]-baseline
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+def benchmark_calls(prepare, names, repeat=3):
+    """minimal wall time of repeat runs and peak memory of one more traced run for a sequence of calls
+    prepare() returns the calls of one run, every call is measured separately
+    returns a list of (name, seconds, peak_memory_bytes)"""
+    seconds = [[] for name in names]
+    peaks = [None for name in names]
+    for index in range(repeat+1):
+        traced = index == repeat
+        for position, call in enumerate(prepare()):
+            call_seconds, peaks[position] = measure(call, traced)
+            if not traced:
+                seconds[position].append(call_seconds)
+    return [(name, min(call_seconds), peak) for name, call_seconds, peak in zip(names, seconds, peaks)]
+
+def benchmark_stages(datapoints, inner_volume, precision='double', repeat=3):
+    """wall time and peak memory of every stage and of a complete calc_signature
+    stages are calculated one after the other on the same calculator, so every stage is measured
+    with the stages it depends on already calculated.
+    returns a list of (stage, method, seconds, peak_memory_bytes)"""
+    stages = [stage for stage in MixedCrystalSignature.STAGE_DEPENDENCIES if stage not in COPY_STAGES]
+
+    def make_calculator():
+        sign_calculator = MixedCrystalSignature(precision=precision)
+        sign_calculator.set_datapoints(datapoints)
+        sign_calculator.set_inner_volume(inner_volume)
+        return sign_calculator
+
+    def prepare():
+        sign_calculator = make_calculator()
+        for stage in stages:
+            yield lambda stage=stage: sign_calculator.calc_stages([stage])
+        yield make_calculator().calc_signature
+
+    results = benchmark_calls(prepare, stages+['signature'], repeat)
+    methods = [FUSED_METHODS.get(stage, MixedCrystalSignature.STAGE_METHODS.get(stage, 'calc_msm'))
+               for stage in stages]+['calc_signature']
+    return [(stage, method, seconds, peak) for (stage, seconds, peak), method in zip(results, methods)]
+
+def benchmark_pool(datapoints, inner_volume, pool, tiles, precision='double', repeat=3):
+    """wall time and peak memory (main process) of calc_signature_tiled with pool"""
+    def prepare():
+        sign_calculator = MixedCrystalSignature(pool=pool, precision=precision)
+        sign_calculator.set_datapoints(datapoints)
+        sign_calculator.set_inner_volume(inner_volume)
+        yield lambda: sign_calculator.calc_signature_tiled(tiles)
+    (stage, seconds, peak), = benchmark_calls(prepare, ['signature'], repeat)
+    return [(stage, 'calc_signature_tiled', seconds, peak)]
+
+def get_metadata():
+    "versions, hardware and commit of the benchmark run"
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'numba': numba.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'numba_threads': numba.config.NUMBA_NUM_THREADS}
+
+def run_benchmarks(sizes=(1000, 10000, 100000), structure='fcc', noise=0.05, precision='double',
+                   modes=('serial', 'threads'), workers=None, tiles=(2, 2, 2), repeat=3,
+                   inner_distance=2, loglevel=1):
+    """benchmark all stages for every size and mode, returns a dict with metadata and results
+    (one record per size, mode and stage)"""
+    if workers is None:
+        workers = os.cpu_count()
+    warmup(precision=precision)
+    records = []
+    pool = mp.Pool(workers) if 'pool' in modes else None
+    try:
+        for size in sizes:
+            datapoints, side = make_dataset(size, structure, noise)
+            inner_volume = [[inner_distance, side-inner_distance]]*3
+            for mode in modes:
+                if mode == 'pool':
+                    results = benchmark_pool(datapoints, inner_volume, pool, tiles, precision, repeat)
+                else:
+                    numba.set_num_threads(1 if mode == 'serial' else numba.config.NUMBA_NUM_THREADS)
+                    results = benchmark_stages(datapoints, inner_volume, precision, repeat)
+                for stage, method, seconds, peak in results:
+                    record = {'size': size,
+                              'n_points': datapoints.shape[0],
+                              'structure': structure,
+                              'noise': noise,
+                              'precision': precision,
+                              'mode': mode,
+                              'workers': workers if mode == 'pool' else 1,
+                              'stage': stage,
+                              'method': method,
+                              'seconds': seconds,
+                              'particles_per_second': datapoints.shape[0]/seconds if seconds > 0 else float('inf'),
+                              'peak_memory_bytes': peak}
+                    records.append(record)
+                    if loglevel >= 1:
+                        print('{size:>8d} {mode:>8s} {stage:>26s} {seconds:10.4f} s '
+                              '{particles_per_second:12.0f} particles/s '
+                              '{peak_memory_bytes:12d} bytes'.format(**record))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        numba.set_num_threads(numba.config.NUMBA_NUM_THREADS)
+    return {'metadata': get_metadata(), 'results': records}
+
+def record_key(record):
+    return (record['size'], record['structure'], record['precision'], record['mode'],
+            record['workers'], record['stage'])
+
+def compare(old, new):
+    """print the speedup of every stage of new over old (results of run_benchmarks)"""
+    old_records = {record_key(record): record for record in old['results']}
+    print('old commit:', old['metadata'].get('commit'), 'new commit:', new['metadata'].get('commit'))
+    for record in new['results']:
+        old_record = old_records.get(record_key(record))
+        if old_record is None:
+            continue
+        print('{:>8d} {:>8s} {:>26s} {:10.4f} s -> {:10.4f} s speedup {:6.2f} memory {:6.2f}'.format(
+            record['size'], record['mode'], record['stage'], old_record['seconds'], record['seconds'],
+            old_record['seconds']/record['seconds'],
+            record['peak_memory_bytes']/max(old_record['peak_memory_bytes'], 1)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the stages of MixedCrystalSignature')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='approximate numbers of particles')
+    parser.add_argument('--structure', choices=sorted(STRUCTURES), default='fcc')
+    parser.add_argument('--noise', type=float, default=0.05, help='sigma of the gaussian noise')
+    parser.add_argument('--precision', choices=sorted(MixedCrystalSignature.PRECISIONS), default='double')
+    parser.add_argument('--modes', choices=MODES, nargs='+', default=['serial', 'threads'])
+    parser.add_argument('--workers', type=int, default=None, help='processes of the pool mode')
+    parser.add_argument('--tiles', type=int, nargs=3, default=[2, 2, 2], help='tiles of the pool mode')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='json file for the results')
+    parser.add_argument('--compare', default=None, help='json file of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    benchmark = run_benchmarks(args.sizes, args.structure, args.noise, args.precision, args.modes,
+                               args.workers, tuple(args.tiles), args.repeat)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(benchmark, file, indent=1)
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            compare(json.load(file), benchmark)
+    return benchmark
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -6,13 +6,17 @@ Created on Wed Jun 14 08:51:08 2017
 @author: dietz
 """
 
+import os
+import json
+import hashlib
 import numpy as np
 import time
 
 import datageneration.generatecrystaldata as gcn
 import datageneration.disordercrystaldata as dcs
+import signature.classification as classification
+from mixedcrystalsignature import MixedCrystalSignature
 
-from sklearn.metrics import accuracy_score
 import pickle
 
 class CrystalAnalyzer:
@@ -20,10 +24,25 @@ class CrystalAnalyzer:
     
     STRUCTURES=['fcc','hcp','bcc']
     LABELS2STRUCT={'fcc':1,'hcp':2,'bcc':3} 
+    CACHE_FIELDS=['sign_arr','voro_vols','softness','data_idx']
+    CACHE_VERSION=1
     
     def __init__(self, classifier, scaler, sign_calculator, train_seed=0, test_seed=0,
                  train_noiselist=list(range(4,12,1)), noiselist=list(range(0,21)),
-                 volume=[15,15,15], inner_distance=2, loglevel=1):
+                 volume=[15,15,15], inner_distance=2, loglevel=1, pool=None, cache_dir=None,
+                 legacy_noise=True, noise_dtype=np.float64):
+        """pool is an optional pool from the multiprocessing module (default: the pool of
+        sign_calculator), the signatures of all (structure, noise) datasets are then calculated
+        in parallel with fresh calculators (same settings as sign_calculator),
+        results do not depend on the number of workers
+        cache_dir is an optional directory for the signatures of every (structure, noise)
+        dataset as memory mapped .npy files, addressed by a hash of the datapoints and settings.
+        Cached results are reused by generate_train_signatures and generate_test_signatures,
+        only missing ones are calculated
+        all noise levels of a structure are scaled from one displacement field per seed,
+        see datageneration.disordercrystaldata.GaussianNoiseLevels. legacy_noise=True gives
+        the datasets of add_gaussian_noise, legacy_noise=False draws the field with
+        np.random.Generator, noise_dtype=np.float32 halves the memory of the datasets"""
         self.classifier=classifier
         self.scaler=scaler
         self.sign_calculator=sign_calculator
@@ -35,11 +54,17 @@ class CrystalAnalyzer:
         self.volume=volume
         self.inner_distance=inner_distance
         self.loglevel=loglevel
+        if pool is None:
+            pool=sign_calculator.p
+        self.pool=pool
+        self.cache_dir=cache_dir
+        self.legacy_noise=legacy_noise
+        self.noise_dtype=noise_dtype
         
     def create_artificial_datasets(self, noise_arr, structure_arr, volume, rnd_seed):
         datasets=dict()
         for structure in structure_arr:
-            datasets[structure]={'noise':[],'datalist':[]}
+            datasets[structure]={'noise':list(noise_arr)}
             basedata=[]
             if 'fcc' == structure:
                 basedata=gcn.fill_volume_fcc(volume[0], volume[1], volume[2])
@@ -48,31 +73,95 @@ class CrystalAnalyzer:
             if 'bcc' == structure:
                 basedata=gcn.fill_volume_bcc(volume[0], volume[1], volume[2])
             
-            for noise in noise_arr:
-                datasets[structure]['datalist'].append(dcs.add_gaussian_noise(basedata, noise/100, rnd_seed))
-                datasets[structure]['noise'].append(noise)
+            datasets[structure]['datalist']=dcs.GaussianNoiseLevels(basedata,
+                                                                   [noise/100 for noise in noise_arr],
+                                                                   rnd_seed,self.noise_dtype,self.legacy_noise)
         return datasets
     
+    def get_job(self, datasets, inner_bool_vecs, structure, i):
+        """arguments of calc_artificial_signature for dataset i of structure"""
+        return (datasets[structure]['datalist'][i],inner_bool_vecs[structure],
+                self.sign_calculator.solid_thresh,self.sign_calculator.L_VEC,
+                self.sign_calculator.signature_dtype,self.sign_calculator.precision)
+    
     def calculate_artificial_signatures(self, datasets):
+        job_keys=[]
+        results=dict()
+        cache_paths=dict()
+        inner_bool_vecs=dict()
+        for structure in datasets:
+            initial_datapoints=datasets[structure]['datalist'][0]
+            inner_bool_vecs[structure]=self.get_inner_volume_bool_vec(initial_datapoints)
+            for i in range(len(datasets[structure]['datalist'])):
+                if self.cache_dir is not None:
+                    job=self.get_job(datasets,inner_bool_vecs,structure,i)
+                    cache_paths[(structure,i)]=self.get_cache_paths(structure,datasets[structure]['noise'][i],job)
+                    results[(structure,i)]=self.load_cached_signature(cache_paths[(structure,i)])
+                    if results[(structure,i)] is not None:
+                        continue
+                job_keys.append((structure,i))
+        
+        #noisy datasets are created on demand instead of all at once
+        jobs=(self.get_job(datasets,inner_bool_vecs,structure,i) for structure,i in job_keys)
+        if self.pool is not None:
+            computed=self.pool.imap(calc_artificial_signature,jobs)
+        else:
+            computed=(calc_artificial_signature(job,self.sign_calculator) for job in jobs)
+        for (structure,i),result in zip(job_keys,computed):
+            results[(structure,i)]=result
+            if self.cache_dir is not None:
+                self.save_cached_signature(cache_paths[(structure,i)],result)
+        
         signatures=dict()
         for structure in datasets:
             signatures[structure]={'sign_arr':[],'voro_vols':[], 'softness':[], 'data_idx':[]}
-            initial_datapoints=datasets[structure]['datalist'][0]
-            inner_bool_vec=self.get_inner_volume_bool_vec(initial_datapoints)
-            for i,datapoints in enumerate(datasets[structure]['datalist']):
-                self.sign_calculator.set_datapoints(datapoints)
-                self.sign_calculator.set_inner_bool_vec(inner_bool_vec)
-                self.sign_calculator.calc_signature()
-                signatures[structure]['sign_arr'].append(self.sign_calculator.signature)
-                signatures[structure]['voro_vols'].append(self.sign_calculator.voro_vols)
-                signatures[structure]['softness'].append(self.sign_calculator.struct_order)
-                signatures[structure]['data_idx'].append(self.sign_calculator.solid_indices)
+            for i in range(len(datasets[structure]['datalist'])):
+                signature_matrix,voro_vols,struct_order,solid_indices=results[(structure,i)]
+                signatures[structure]['sign_arr'].append(signature_matrix)
+                signatures[structure]['voro_vols'].append(voro_vols)
+                signatures[structure]['softness'].append(struct_order)
+                signatures[structure]['data_idx'].append(solid_indices)
                 if self.loglevel >= 3:
                     print('struc:',structure,
                           'noise:',datasets[structure]['noise'][i],
-                          'num:', len(self.sign_calculator.signature))
+                          'num:', signature_matrix.shape[0])
         return signatures
     
+    def get_cache_paths(self, structure, noise, job):
+        """paths of the cached results of a signature job
+        the key is a hash of the datapoints, the inner volume, the calculator settings and the
+        signature schema, so any change of volume, seed, noise or L_VEC gives a new entry"""
+        datapoints,inner_bool_vec,solid_thresh,l_vec,signature_dtype,precision=job
+        settings={'solid_thresh':float(solid_thresh),
+                  'l_vec':[int(l) for l in l_vec],
+                  'signature_dtype':np.dtype(signature_dtype).str,
+                  'precision':precision,
+                  'signature_columns':self.sign_calculator.signature_columns,
+                  'version':self.CACHE_VERSION}
+        key=hashlib.sha1()
+        key.update(np.ascontiguousarray(datapoints,dtype=np.float64).tobytes())
+        key.update(np.ascontiguousarray(inner_bool_vec,dtype=np.bool).tobytes())
+        key.update(json.dumps(settings,sort_keys=True).encode())
+        prefix=os.path.join(self.cache_dir,'{}_noise{}_{}'.format(structure,noise,key.hexdigest()[:20]))
+        return {field:prefix+'_'+field+'.npy' for field in self.CACHE_FIELDS}
+    
+    def load_cached_signature(self, paths):
+        """memory mapped results of a signature job from the cache paths (see get_cache_paths),
+        None if not cached"""
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        return tuple(np.load(paths[field],mmap_mode='r') for field in self.CACHE_FIELDS)
+    
+    def save_cached_signature(self, paths, result):
+        """write the results of a signature job to the cache paths (see get_cache_paths),
+        every file appears atomically"""
+        os.makedirs(self.cache_dir,exist_ok=True)
+        for field,array in zip(self.CACHE_FIELDS,result):
+            tmp_path=paths[field]+'.tmp'
+            with open(tmp_path,'wb') as file:
+                np.save(file,array)
+            os.replace(tmp_path,paths[field])
+    
     def convert_artificial_signatures_to_matrix(self,signatures):
         index_dict=dict()
         startindex=0
@@ -128,11 +217,13 @@ class CrystalAnalyzer:
             print('finished training, time:',time.time()-t)
         
         if self.loglevel >=1:
+            from sklearn.metrics import accuracy_score
             trainprediction=self.classifier.predict(self.scaler.transform(self.trainmatrix))
             print('Accuracy on Train set:',
                   accuracy_score(trainprediction,self.trainlabels))
         
     def predict_test(self):
+        from sklearn.metrics import accuracy_score
         for structure in self.test_signatures:
             self.test_signatures[structure]['prediction']=[]
             for i,sign_arr in enumerate(self.test_signatures[structure]['sign_arr']):
@@ -163,10 +254,7 @@ class CrystalAnalyzer:
         return np.all(bool_matrix,axis=1)
     
     def load_object(self, filepath):
-        objects=[]
-        with open(filepath,'rb') as file:
-            objects=pickle.load(file)
-        return objects
+        return classification.load_pickle(filepath)
         
     def save_object(self,objects, filepath):
         with open(filepath,'wb') as file:
@@ -194,4 +282,18 @@ class CrystalAnalyzer:
         self.save_object(self.scaler,path)
     
     def load_scaler(self,path):
-        self.scaler=self.load_object(path)
\ No newline at end of file
+        self.scaler=self.load_object(path)
+
+def calc_artificial_signature(args,sign_calculator=None):
+    """calculate the signature of one artificial dataset for CrystalAnalyzer.calculate_artificial_signatures
+    with a fresh calculator for the given settings if sign_calculator is None"""
+    datapoints,inner_bool_vec,solid_thresh,l_vec,signature_dtype,precision=args
+    datapoints=np.asarray(datapoints,dtype=np.float64)
+    if sign_calculator is None:
+        sign_calculator=MixedCrystalSignature(solid_thresh=solid_thresh,l_vec=l_vec,signature_dtype=signature_dtype,
+                                              precision=precision)
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_inner_bool_vec(inner_bool_vec)
+    sign_calculator.calc_signature()
+    return (sign_calculator.signature_matrix,sign_calculator.voro_vols,
+            sign_calculator.struct_order,sign_calculator.solid_indices)
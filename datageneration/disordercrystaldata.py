@@ -12,7 +12,46 @@ def add_gaussian_noise(datapoints, sigma, rnd_seed):
         return datapoints
     x_len = np.size(datapoints, 0)
     y_len = np.size(datapoints, 1)
-    np.random.seed(seed=rnd_seed)
+    #own random state per call, same numbers as np.random.seed(rnd_seed) without touching the global state
+    random_state = np.random.RandomState(seed=rnd_seed)
 
-    rand_gaussian = np.random.normal(loc=0.0, scale=sigma, size=(x_len, y_len))
+    rand_gaussian = random_state.normal(loc=0.0, scale=sigma, size=(x_len, y_len))
     return datapoints+rand_gaussian
+
+def standard_normal_field(shape, rnd_seed, dtype=np.float64, legacy=False):
+    """standard normal displacement field of a seed drawn with np.random.Generator
+    legacy=True draws the numbers of np.random.RandomState(rnd_seed) used by add_gaussian_noise"""
+    if legacy:
+        return np.random.RandomState(seed=rnd_seed).standard_normal(size=shape).astype(dtype, copy=False)
+    return np.random.default_rng(rnd_seed).standard_normal(size=shape, dtype=dtype)
+
+class GaussianNoiseLevels:
+    """datapoints with gaussian noise of several levels drawn from one displacement field
+    level i is datapoints+sigmas[i]*field, it is calculated on access (or while iterating),
+    so only the datapoints and a single field are kept in memory.
+    With legacy=True and dtype float64 level i equals add_gaussian_noise(datapoints, sigmas[i], rnd_seed)"""
+
+    def __init__(self, datapoints, sigmas, rnd_seed, dtype=np.float64, legacy=False):
+        self.datapoints = np.asarray(datapoints, dtype=dtype)
+        self.sigmas = list(sigmas)
+        self.rnd_seed = rnd_seed
+        self.dtype = dtype
+        self.legacy = legacy
+        self.field = None
+
+    def __len__(self):
+        return len(self.sigmas)
+
+    def __getitem__(self, index):
+        sigma = self.sigmas[index]
+        if sigma == 0:
+            return self.datapoints
+        if self.field is None:
+            self.field = standard_normal_field(self.datapoints.shape, self.rnd_seed, self.dtype, self.legacy)
+        noisy = np.multiply(self.field, sigma, dtype=self.dtype)
+        noisy += self.datapoints
+        return noisy
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
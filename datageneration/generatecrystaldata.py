@@ -16,83 +16,147 @@ def make_3d_grid(x_space, y_space, z_space):
     "creates 3d_Grid in given xyz-space"
     return np.vstack(np.meshgrid(x_space, y_space, z_space)).reshape(3, -1).T
 
-def fill_volume_bcc(x_limit, y_limit, z_limit):
-    "fill given volume with BCC structure"
-    calibration_factor = 2./np.sqrt(3)
-    x_space = np.arange(0, 2*x_limit, 1.)
-    y_space = np.arange(0, 2*y_limit, 1.)
-    z_space = np.arange(0, 2*z_limit, 1.)
-    first_grid = make_3d_grid(x_space, y_space, z_space)
-    second_grid = np.copy(first_grid)
-    second_grid += 1./2.
-    crystal = np.vstack((first_grid, second_grid)) * calibration_factor
-    condition = ((crystal[:, 0] <= x_limit)&
-                 (crystal[:, 1] <= y_limit)&
-                 (crystal[:, 2] <= z_limit))
-    return crystal[condition]
+SIN_60 = np.sin(np.pi / 3.)
+HCP_LATTICE_CORRECT = np.sqrt(8/3)
 
-def fill_volume_fcc(x_limit, y_limit, z_limit):
-    "fill given volume with BCC structure"
-    calibration_factor = 2./np.sqrt(2)
-    x_space = np.arange(0, 2*x_limit, 1.)
-    y_space = np.arange(0, 2*y_limit, 1.)
-    z_space = np.arange(0, 2*z_limit, 1.)
-    first_grid = make_3d_grid(x_space, y_space, z_space)
-    second_grid = np.copy(first_grid)
-    third_grid = np.copy(first_grid)
-    fourth_grid = np.copy(first_grid)
-    second_grid[:, 0:2] += 1./2.
-    third_grid[:, 0] += 1./2.
-    third_grid[:, 2] += 1./2.
-    fourth_grid[:, 1:] += 1./2.
-    crystal = np.vstack((first_grid,
-                         second_grid,
-                         third_grid,
-                         fourth_grid)) * calibration_factor
-    condition = ((crystal[:, 0] <= x_limit)&
-                 (crystal[:, 1] <= y_limit)&
-                 (crystal[:, 2] <= z_limit))
-    return crystal[condition]
+#unit cells (lattice vectors as rows) and bases in fractional coordinates,
+#scaled so that the nearest neighbour distance is 1
+SC_CELL = np.eye(3)
+SC_BASIS = np.array([[0., 0., 0.]])
+BCC_CELL = 2./np.sqrt(3) * np.eye(3)
+BCC_BASIS = np.array([[0., 0., 0.],
+                      [1./2., 1./2., 1./2.]])
+FCC_CELL = 2./np.sqrt(2) * np.eye(3)
+FCC_BASIS = np.array([[0., 0., 0.],
+                      [1./2., 1./2., 0.],
+                      [1./2., 0., 1./2.],
+                      [0., 1./2., 1./2.]])
+DIAMOND_CELL = 4./np.sqrt(3) * np.eye(3)
+DIAMOND_BASIS = np.vstack((FCC_BASIS, FCC_BASIS + 1./4.))
+HCP_CELL = np.array([[1., 0., 0.],
+                     [1./2., SIN_60, 0.],
+                     [0., 0., HCP_LATTICE_CORRECT]])
+HCP_BASIS = np.array([[0., 0., 0.],
+                      [1./3., 1./3., 1./2.]])
 
-def add_hcp_line(x_vec, y_coord, z_coord):
-    "create atom line along x-axis with space 1"
-    crystal_line = np.zeros((len(x_vec), 3))
-    crystal_line[:, 0] = x_vec
-    crystal_line[:, 1] = y_coord
-    crystal_line[:, 2] = z_coord
-    return crystal_line
+def rotation_matrix(axis, angle):
+    "rotation matrix of a rotation by angle (radians) around axis"
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis)
+    cross = np.array([[0., -axis[2], axis[1]],
+                      [axis[2], 0., -axis[0]],
+                      [-axis[1], axis[0], 0.]])
+    return (np.cos(angle) * np.eye(3) + np.sin(angle) * cross +
+            (1. - np.cos(angle)) * np.outer(axis, axis))
 
-def add_hcp_layer(noa_x, noa_y, z_coord):
-    "creates HCP Layer"
-    x_vec = np.arange(0, int(round(noa_x)))
-    crystal_volume = np.empty((0, 3))
-    for y_coord in np.arange(0, noa_y, 2*np.sin(np.pi / 3.)):
-        first_line = add_hcp_line(x_vec, y_coord, z_coord)
-        second_line = add_hcp_line(x_vec + 1./2.,
-                                   y_coord + np.sin(np.pi / 3.), z_coord)
-        crystal_volume = np.vstack((crystal_volume, first_line))
-        crystal_volume = np.vstack((crystal_volume, second_line))
-    return crystal_volume
+def is_rotated(rotation):
+    "True if rotation is given and differs from the identity"
+    return rotation is not None and not np.allclose(rotation, np.eye(3))
 
-def fill_volume_hcp(x_space, y_space, z_space):
-    "fill given volume with HCP structure"
-    lattice_correct = np.sqrt(8/3)
+def fill_volume_lattice(x_limit, y_limit, z_limit, cell, basis, rotation=None):
+    """fill given volume [0, limit] with the lattice of a unit cell (lattice vectors as rows)
+    and a basis (fractional coordinates), the lattice is optionally rotated around the origin
+    by the rotation matrix. Points are ordered by cell index and basis."""
+    cell = np.asarray(cell, dtype=np.float64)
+    basis = np.atleast_2d(np.asarray(basis, dtype=np.float64))
+    if rotation is not None:
+        cell = cell @ np.asarray(rotation, dtype=np.float64).T
+    limits = np.array([x_limit, y_limit, z_limit], dtype=np.float64)
+    tolerance = 1e-10 * max(np.max(np.abs(limits)), 1.)
+    #cell index ranges that cover the volume
+    corners = make_3d_grid([0., x_limit], [0., y_limit], [0., z_limit])
+    fractional = corners @ np.linalg.inv(cell)
+    lower = np.floor(np.min(fractional, axis=0) - np.max(basis, axis=0)).astype(np.int64)
+    upper = np.ceil(np.max(fractional, axis=0) - np.min(basis, axis=0)).astype(np.int64)
+    j_vec, k_vec = [np.arange(lower[axis], upper[axis]+1) for axis in (1, 2)]
+    plane = np.stack(np.meshgrid(j_vec, k_vec, indexing='ij'), axis=-1).reshape(-1, 2)
+    plane_offsets = (plane[:, np.newaxis, :] + basis[np.newaxis, :, 1:]) @ cell[1:]
+    plane_offsets = plane_offsets.reshape(-1, 3)
+    #one plane of cells at a time keeps the temporary arrays small
+    slabs = []
+    for i in range(lower[0], upper[0]+1):
+        slab = (plane_offsets.reshape(len(plane), len(basis), 3) +
+                (i + basis[:, 0])[:, np.newaxis] * cell[0]).reshape(-1, 3)
+        condition = np.all((slab >= -tolerance) & (slab <= limits + tolerance), axis=1)
+        slabs.append(slab[condition])
+    return np.concatenate(slabs) if slabs else np.empty((0, 3))
+
+def fill_cubic_sublattices(x_limit, y_limit, z_limit, calibration_factor, offsets):
+    """fill given volume with the cubic sublattices (grid + offset) * calibration_factor
+    the index range of every axis is calculated in advance, the points are ordered per
+    sublattice like make_3d_grid (y, x, z)"""
+    sublattices = []
+    for offset in offsets:
+        axes = []
+        for limit, axis_offset in zip((x_limit, y_limit, z_limit), offset):
+            space = np.arange(0, min(2*limit, np.floor(limit/calibration_factor)+2), 1.)
+            coords = (space + axis_offset) * calibration_factor
+            axes.append(coords[coords <= limit])
+        sublattices.append(axes)
+    crystal = np.empty((sum(len(x) * len(y) * len(z) for x, y, z in sublattices), 3))
+    start = 0
+    for x_coords, y_coords, z_coords in sublattices:
+        size = len(x_coords) * len(y_coords) * len(z_coords)
+        view = crystal[start:start+size].reshape(len(y_coords), len(x_coords), len(z_coords), 3)
+        view[..., 0] = x_coords[np.newaxis, :, np.newaxis]
+        view[..., 1] = y_coords[:, np.newaxis, np.newaxis]
+        view[..., 2] = z_coords[np.newaxis, np.newaxis, :]
+        start += size
+    return crystal
+
+def fill_volume_sc(x_limit, y_limit, z_limit, rotation=None):
+    "fill given volume with SC structure"
+    return fill_volume_lattice(x_limit, y_limit, z_limit, SC_CELL, SC_BASIS, rotation)
+
+def fill_volume_diamond(x_limit, y_limit, z_limit, rotation=None):
+    "fill given volume with diamond structure"
+    return fill_volume_lattice(x_limit, y_limit, z_limit, DIAMOND_CELL, DIAMOND_BASIS, rotation)
+
+def fill_volume_bcc(x_limit, y_limit, z_limit, rotation=None):
+    """fill given volume with BCC structure
+    an identity rotation returns the same points in the same order as no rotation"""
+    if is_rotated(rotation):
+        return fill_volume_lattice(x_limit, y_limit, z_limit, BCC_CELL, BCC_BASIS, rotation)
+    return fill_cubic_sublattices(x_limit, y_limit, z_limit, 2./np.sqrt(3), BCC_BASIS)
+
+def fill_volume_fcc(x_limit, y_limit, z_limit, rotation=None):
+    """fill given volume with FCC structure
+    an identity rotation returns the same points in the same order as no rotation"""
+    if is_rotated(rotation):
+        return fill_volume_lattice(x_limit, y_limit, z_limit, FCC_CELL, FCC_BASIS, rotation)
+    return fill_cubic_sublattices(x_limit, y_limit, z_limit, 2./np.sqrt(2), FCC_BASIS)
+
+def fill_volume_hcp(x_space, y_space, z_space, rotation=None):
+    """fill given volume with HCP structure
+    layers in the xy-plane with lines along the x-axis, stacked ABAB along the z-axis
+    the lines start at their first x >= 0 of the unshifted layer, so the shifted layer
+    leaves out x=0 of every second line. An identity rotation returns the same points
+    in the same order as no rotation, other rotations fill the volume with the full lattice"""
+    if is_rotated(rotation):
+        return fill_volume_lattice(x_space, y_space, z_space, HCP_CELL, HCP_BASIS, rotation)
     noa_x = int(round(x_space))
-    noa_y = int(round(y_space / (np.sin(np.pi / 3.))))
-    noa_z = int(round(z_space / (lattice_correct/2.)))
-    crystal = np.empty((0, 3))
-    unshifted_layer = True
-    for z_coord in np.arange(0, noa_z+1, lattice_correct/2.):
-        if unshifted_layer:
-            cur_crystal = add_hcp_layer(noa_x + 1, noa_y + 1, z_coord)
-            unshifted_layer = False
-        else:
-            cur_crystal = add_hcp_layer(noa_x + 1, noa_y + 1, z_coord)
-            cur_crystal[:, 0] += 1./2.
-            cur_crystal[:, 1] += 1./(2*np.sqrt(3))
-            unshifted_layer = True
-        crystal = np.vstack((crystal, cur_crystal))
-        condition = ((crystal[:, 0] <= x_space)&
-                     (crystal[:, 1] <= y_space)&
-                     (crystal[:, 2] <= z_space))
-    return crystal[condition]
+    noa_y = int(round(y_space / SIN_60))
+    noa_z = int(round(z_space / (HCP_LATTICE_CORRECT/2.)))
+    x_vec = np.arange(0, int(round(noa_x + 1)))
+    y_vec = np.arange(0, noa_y + 1, 2*SIN_60)
+    z_vec = np.arange(0, noa_z+1, HCP_LATTICE_CORRECT/2.)
+    z_vec = z_vec[z_vec <= z_space]
+    #xy-coordinates of the unshifted and the shifted layer: y index, line, x index
+    layers = []
+    for x_shift, y_shift in ((0., 0.), (1./2., 1./(2*np.sqrt(3)))):
+        line_x = [x_vec + 0. + x_shift, x_vec + 1./2. + x_shift]
+        line_y = [y_vec + y_shift, y_vec + SIN_60 + y_shift]
+        layer_x = np.concatenate([np.broadcast_to(x_coords, (len(y_vec), len(x_coords)))
+                                  for x_coords in line_x], axis=1)
+        layer_y = np.concatenate([np.broadcast_to(y_coords[:, np.newaxis], (len(y_vec), len(x_vec)))
+                                  for y_coords in line_y], axis=1)
+        condition = (layer_x <= x_space) & (layer_y <= y_space)
+        layers.append(np.stack((layer_x[condition], layer_y[condition]), axis=1))
+    layer_sizes = np.array([len(layers[index % 2]) for index in range(len(z_vec))], dtype=np.int64)
+    crystal = np.empty((np.sum(layer_sizes), 3))
+    start = 0
+    for index, z_coord in enumerate(z_vec):
+        crystal[start:start+layer_sizes[index], :2] = layers[index % 2]
+        crystal[start:start+layer_sizes[index], 2] = z_coord
+        start += layer_sizes[index]
+    return crystal
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming readers of trajectories (xyz, LAMMPS dump, npy), one frame at a time
+"""
+
+import os
+import re
+from itertools import islice
+import numpy as np
+
+LAMMPS_COORDINATES = [('x', 'y', 'z'), ('xu', 'yu', 'zu'), ('xs', 'ys', 'zs')]
+
+def frame_selected(index, start, step):
+    "checks if frame index is part of the selection start::step"
+    return index >= start and (index-start) % step == 0
+
+def parse_xyz_box(comment):
+    "box of an extended xyz comment line, None for missing lattice or non periodic frames"
+    lattice = re.search(r'Lattice="([^"]*)"', comment)
+    pbc = re.search(r'pbc="([^"]*)"', comment)
+    if lattice is None or (pbc is not None and 'F' in pbc.group(1).upper()):
+        return None
+    cell = np.array(lattice.group(1).split(), dtype=np.float64).reshape(3, 3)
+    if np.any(cell[~np.eye(3, dtype=np.bool_)] != 0.):
+        raise ValueError('only orthorhombic boxes are supported')
+    origin = re.search(r'Origin="([^"]*)"', comment)
+    box_min = np.zeros(3) if origin is None else np.array(origin.group(1).split(), dtype=np.float64)
+    return np.stack((box_min, box_min+np.diag(cell)), axis=1)
+
+def read_xyz(path, start=0, stop=None, step=1):
+    """reads the frames of an (extended) xyz file lazily
+    every frame consists of the number of particles, a comment line and one line
+    'type x y z ...' per particle. Yields (frame index, datapoints, box) for the frames
+    start:stop:step, box is read from an orthorhombic Lattice="..." entry of the comment line
+    (None otherwise). Skipped frames are not parsed."""
+    with open(path, 'r') as file:
+        index = 0
+        while stop is None or index < stop:
+            header = file.readline()
+            if not header.strip():
+                return
+            n_points = int(header)
+            comment = file.readline()
+            lines = islice(file, n_points)
+            if frame_selected(index, start, step):
+                datapoints = np.loadtxt(lines, usecols=(1, 2, 3), dtype=np.float64, ndmin=2)
+                yield index, datapoints, parse_xyz_box(comment)
+            else:
+                for _ in lines:
+                    pass
+            index += 1
+
+def read_lammps_dump(path, start=0, stop=None, step=1):
+    """reads the frames of a LAMMPS text dump lazily
+    coordinates are taken from the x y z, xu yu zu or xs ys zs columns, particles are
+    sorted by id if the dump has an id column. Yields (timestep, datapoints, box) for the
+    frames start:stop:step (counted in frames, not timesteps), box is None unless all
+    dimensions are periodic. Skipped frames are not parsed."""
+    with open(path, 'r') as file:
+        index = 0
+        while stop is None or index < stop:
+            line = file.readline()
+            if not line.strip():
+                return
+            timestep = int(file.readline())
+            file.readline()
+            n_points = int(file.readline())
+            bounds_header = file.readline().split()
+            if len(bounds_header) > 6:
+                raise ValueError('only orthorhombic boxes are supported')
+            bounds = np.array([file.readline().split()[:2] for _ in range(3)], dtype=np.float64)
+            columns = file.readline().split()[2:]
+            lines = islice(file, n_points)
+            if not frame_selected(index, start, step):
+                for _ in lines:
+                    pass
+                index += 1
+                continue
+
+            for coordinates in LAMMPS_COORDINATES:
+                if all(column in columns for column in coordinates):
+                    break
+            else:
+                raise ValueError('dump contains no coordinate columns')
+            usecols = [columns.index(column) for column in coordinates]
+            if 'id' in columns:
+                usecols.append(columns.index('id'))
+            values = np.loadtxt(lines, usecols=usecols, dtype=np.float64, ndmin=2)
+            datapoints = values[:, :3]
+            if 'id' in columns:
+                datapoints = datapoints[np.argsort(values[:, 3], kind='stable')]
+            if coordinates[0] == 'xs':
+                datapoints = bounds[:, 0]+datapoints*(bounds[:, 1]-bounds[:, 0])
+            box = bounds if bounds_header[3:6] == ['pp', 'pp', 'pp'] else None
+            yield timestep, np.ascontiguousarray(datapoints), box
+            index += 1
+
+def read_npy(path, start=0, stop=None, step=1, box=None):
+    """reads the frames of a (frames, particles, 3) .npy stack lazily via a memory map
+    Yields (frame index, datapoints, box) for the frames start:stop:step,
+    only the current frame is loaded into memory."""
+    stack = np.load(path, mmap_mode='r')
+    if stack.ndim != 3 or stack.shape[2] != 3:
+        raise ValueError('expected an array of shape (frames, particles, 3)')
+    for index in range(*slice(start, stop, step).indices(stack.shape[0])):
+        yield index, np.array(stack[index], dtype=np.float64), box
+
+def read_trajectory(path, fmt=None, start=0, stop=None, step=1):
+    """reads the frames of a trajectory lazily, see read_xyz, read_lammps_dump and read_npy
+    fmt is 'xyz', 'lammps' or 'npy', by default it is guessed from the file name"""
+    if fmt is None:
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.xyz', '.extxyz'):
+            fmt = 'xyz'
+        elif extension == '.npy':
+            fmt = 'npy'
+        elif extension in ('.dump', '.lammpstrj') or 'dump' in os.path.basename(path):
+            fmt = 'lammps'
+        else:
+            raise ValueError('unknown trajectory format of {}'.format(path))
+    readers = {'xyz': read_xyz, 'lammps': read_lammps_dump, 'npy': read_npy}
+    return readers[fmt](path, start=start, stop=stop, step=step)
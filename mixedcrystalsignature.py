@@ -6,65 +6,225 @@ Created on Wed Apr 1 15:00:00 2018
 @author: Christopher Dietz
 """
 
+import time
+from contextlib import contextmanager
 import numpy as np
-import pandas as pd
-from scipy.spatial import Voronoi, ConvexHull
 import signature.calculations as calc
-from functools import partial
+import signature.classification as classification
+import signature.profiling as profiling
+import datageneration.generatecrystaldata as gcn
 
 class MixedCrystalSignature:
     """Class for calculation of the Mixed Crystal Signature 
     Description in https://doi.org/10.1103/PhysRevE.96.011301"""
 
     L_VEC = np.array([4, 5, 6],dtype=np.int32) #Choose which l to use for calculation of qlm 
-    MAX_L = np.max(L_VEC)
+    
+    FEATURE_GROUPS = ['N', 'ba', 'ql', 'wl', 'zeta', 'dist']
+    #calculation stages and the stages they depend on, in calculation order
+    STAGE_DEPENDENCIES = {'voro': [],
+                          'neighborlist': ['voro'],
+                          'needed_cells': ['neighborlist'],
+                          'convex_hulls': ['needed_cells'],
+                          'qlm': ['convex_hulls'],
+                          'struct_order': ['qlm'],
+                          'solid': ['struct_order'],
+                          'signature_matrix': ['solid'],
+                          'bond_angle_distance_hists': ['solid'],
+                          'N': ['signature_matrix'],
+                          'ba': ['signature_matrix', 'bond_angle_distance_hists'],
+                          'ql': ['signature_matrix'],
+                          'wl': ['signature_matrix'],
+                          'zeta': ['signature_matrix'],
+                          'dist': ['signature_matrix', 'bond_angle_distance_hists']}
+    STAGE_METHODS = {'voro': 'calc_voro',
+                     'neighborlist': 'calc_neighborlist',
+                     'needed_cells': 'calc_needed_cells',
+                     'convex_hulls': 'calc_convex_hulls',
+                     'qlm': 'calc_qlm',
+                     'struct_order': 'calc_struct_order',
+                     'solid': 'calc_solid_indices',
+                     'signature_matrix': 'init_signature_matrix',
+                     'bond_angle_distance_hists': 'calc_bond_angle_distance_hists',
+                     'N': 'calc_num_neigh',
+                     'ba': 'calc_bond_angles',
+                     'zeta': 'calc_minkowski_eigvals',
+                     'dist': 'calc_hist_distances'}
+    #dtypes of the stored facets and qlm per precision mode
+    PRECISIONS = {'double': (np.float64, np.complex128),
+                  'single': (np.float32, np.complex64)}
 
-    def __init__(self, solid_thresh=0.55, pool=None):
+    def __init__(self, solid_thresh=0.55, pool=None, l_vec=None, signature_dtype=None, precision='double'):
         """solid_thresh is a threshold between 0 (very disordered) and 1 (very crystalline)
-        pool is a pool from the multiprocessing module.
-        If no pool is provided, the calculation will be single-core""" 
+        calc_signature runs in parallel numba kernels on all cores (see numba.set_num_threads),
+        pool is an optional pool from the multiprocessing module, used by
+        calc_signature_tiled to calculate the tiles in parallel and by default by
+        CrystalAnalyzer to calculate the artificial signatures in parallel
+        l_vec optionally replaces L_VEC, any l is supported (e.g. [4, 5, 6, 8, 10, 12]),
+        l=6 is always needed for the structural order
+        signature_dtype is the dtype of signature_matrix (np.float64 or np.float32),
+        by default float64 in double and float32 in single precision
+        precision 'single' stores facets and qlm as float32 and complex64 (half the memory),
+        the tessellation, cell volumes and all sums are still calculated in double precision""" 
+        if l_vec is not None:
+            self.L_VEC = np.array(l_vec,dtype=np.int32)
+            if 6 not in self.L_VEC:
+                raise ValueError('l_vec has to contain l=6, it is needed for the structural order and the solid detection')
         self.solid_thresh = solid_thresh
         self.inner_bool = None
         self.indices = None
         self.outsider_indices = None
         self.insider_indices = None
+        self.box = None
+        self.box_lengths = np.zeros(3,dtype=np.float64)
+        self.halo = None
+        self.voro_points = None
+        self.point_images = None
         self.voro = None
-        self.neighborlist = None
-        self.conv_hulls = None
+        self.ridge_indptr = None
+        self.ridge_vertices = None
+        self.bounded_bool = None
+        self.valid_bool = None
+        self.shell_bool = None
+        self.needed_bool = None
+        self.needed_indices = None
+        self.neighbor_indptr = None
+        self.neighbor_indices = None
+        self.neighbor_ridges = None
+        self.facet_areas = None
+        self.facet_normals = None
+        self.total_areas = None
         self.voro_vols = None
+        self.ridge_areas = None
+        self.geometry_bool = None
         self.qlm_arrays = None
-        self.signature = pd.DataFrame()
+        self.qlm_bool = None
+        self.qlm_l_vec = None
+        self.qlm_offsets = None
+        self.computed_stages = set()
+        self.stage_solid_thresh = None
+        self.bond_angles = None
+        self.hist_distances = None
+        if precision not in self.PRECISIONS:
+            raise ValueError('precision has to be one of {}'.format(list(self.PRECISIONS)))
+        self.precision = precision
+        self.facet_dtype, self.qlm_dtype = self.PRECISIONS[precision]
+        if signature_dtype is None:
+            signature_dtype = self.facet_dtype
+        self.signature_dtype = signature_dtype
+        self.signature_matrix = None
         self.datapoints = None
+        self.profiler = None
         
         self.p = None
         if pool is not None:
             self.p = pool
         
-        self.len_qlm=0
-        self.idx_qlm=dict()
-        for i,l in enumerate(self.L_VEC):
-            self.idx_qlm[l]=np.arange(self.len_qlm,self.len_qlm+2*l+1,dtype=np.int32)
-            self.len_qlm += (2*self.L_VEC[i]+1)   
+        #fixed column schema of the signature, every feature group is a slice of the columns
+        feature_groups=[('N',['N']),
+                        ('ba',['ba{:d}'.format(dim) for dim in range(len(calc.ANGLE_EDGES)-1)]),
+                        ('ql',['q{:d}'.format(l) for l in self.L_VEC]),
+                        ('wl',['w{:d}'.format(l) for l in self.L_VEC if l%2==0]), #odd number w_l are useless
+                        ('zeta',['zeta{:d}'.format(dim) for dim in range(6)]),
+                        ('dist',['dist{:d}'.format(dim) for dim in range(calc.NBINS_DISTANCES)])]
+        self.signature_columns=[]
+        self.signature_slices=dict()
+        for group,columns in feature_groups:
+            self.signature_slices[group]=slice(len(self.signature_columns),len(self.signature_columns)+len(columns))
+            self.signature_columns+=columns
+        self.signature_matrix=np.zeros((0,len(self.signature_columns)),dtype=self.signature_dtype)
+    
+    @property
+    def signature(self):
+        """signature of all solid particles as pandas DataFrame
+        zero-copy view of signature_matrix with signature_columns, created on request"""
+        import pandas as pd #deferred, pandas is slow to import and only needed here
+        return pd.DataFrame(self.signature_matrix,columns=self.signature_columns,copy=False)
     
     def set_datapoints(self,data):
-        """provide datapoints for signature calculation"""
-        self.datapoints=data
+        """provide datapoints for signature calculation
+        the coordinates are stored in double precision (also in precision 'single')"""
+        self.datapoints=np.asarray(data,dtype=np.float64)
         self.inner_bool=np.ones(self.datapoints.shape[0],dtype=np.bool)
         self.calc_inner_outer_indices()
+        self.reset_stages()
+        
+    def set_box(self,box,halo=None):
+        """activate periodic boundary conditions
+        format of the box:
+        box=[[x_min,xmax],[y_min,y_max],[z_min,z_max]]
+        The tessellation adds ghost images of all particles within halo of a face
+        (default: two mean particle distances). The halo is enlarged automatically
+        until every voronoi cell of the box is exact, ghost neighbors are mapped back
+        to their original indices. box=None switches back to an open point cloud."""
+        if box is None:
+            self.box=None
+            self.box_lengths=np.zeros(3,dtype=np.float64)
+        else:
+            self.box=np.array(box,dtype=np.float64)
+            self.box_lengths=self.box[:,1]-self.box[:,0]
+        self.halo=halo
+        self.reset_stages()
         
     def calc_voro(self):
-        """calculate voronoi diagram of the datapoints"""
-        self.voro=Voronoi(self.datapoints)
+        """calculate voronoi diagram of the datapoints
+        in periodic mode (see set_box) the datapoints are wrapped into the box and a halo of
+        ghost images is tessellated with them"""
+        from scipy.spatial import Voronoi #deferred to the first tessellation
+        if self.box is None:
+            self.voro_points=self.datapoints
+            self.point_images=None
+            self.voro=Voronoi(self.voro_points)
+            self.ridge_indptr, self.ridge_vertices = calc.flatten_ridge_vertices(self.voro.ridge_vertices)
+            return
+        
+        halo=self.halo
+        if halo is None:
+            halo=2*(np.prod(self.box_lengths)/self.datapoints.shape[0])**(1/3)
+        while True:
+            if halo>=np.min(self.box_lengths):
+                raise ValueError('periodic box is too small for the needed halo of {:f}'.format(halo))
+            self.voro_points,self.point_images=calc.calc_periodic_images(self.datapoints,self.box,halo)
+            self.voro=Voronoi(self.voro_points)
+            self.ridge_indptr, self.ridge_vertices = calc.flatten_ridge_vertices(self.voro.ridge_vertices)
+            original_bool=np.zeros(self.voro_points.shape[0],dtype=np.bool)
+            original_bool[:self.datapoints.shape[0]]=True
+            if calc.check_cells_exact(self.voro_points,self.voro.vertices,self.voro.ridge_points,
+                                      self.ridge_indptr,self.ridge_vertices,original_bool,
+                                      self.box[:,0]-halo,self.box[:,1]+halo):
+                break
+            halo*=1.5
         
     def calc_neighborlist(self):
-        """retrieve neighborlists from voronoi diagram"""
-        ridge_points=self.voro.ridge_points
-        self.neighborlist=[[] for _ in range(self.datapoints.shape[0])]
-        for j in range(len(ridge_points)):
-            if ridge_points[j,1] not in self.neighborlist[ridge_points[j,0]]:
-                self.neighborlist[ridge_points[j,0]].append(ridge_points[j,1])
-            if ridge_points[j,0] not in self.neighborlist[ridge_points[j,1]]:
-                self.neighborlist[ridge_points[j,1]].append(ridge_points[j,0])
+        """retrieve neighbors from voronoi diagram as a CSR graph
+        neighbors of particle i are neighbor_indices[neighbor_indptr[i]:neighbor_indptr[i+1]]"""
+        (self.neighbor_indptr,
+         self.neighbor_indices,
+         self.neighbor_ridges) = calc.calc_neighbor_csr(self.voro.ridge_points, self.datapoints.shape[0],
+                                                        self.point_images)
+        n_points=self.datapoints.shape[0]
+        self.bounded_bool=np.invert(calc.calc_unbounded_points(self.voro.ridge_points,
+                                                               self.ridge_indptr,
+                                                               self.ridge_vertices,
+                                                               self.voro_points.shape[0])[:n_points])
+        rows=np.repeat(self.indices,np.diff(self.neighbor_indptr))
+        unbounded_neighbors=np.bincount(rows,weights=np.invert(self.bounded_bool[self.neighbor_indices]),
+                                        minlength=n_points)
+        self.valid_bool=np.logical_and(self.bounded_bool,unbounded_neighbors==0)
+        #cell geometry and qlm of an old neighbor graph are outdated
+        self.ridge_areas=None
+        self.geometry_bool=None
+        self.qlm_bool=None
+        
+    def calc_needed_cells(self):
+        """calculate which voronoi cells are needed for the inner volume
+        Only insiders and their first neighbor shell enter the signature,
+        unbounded cells are excluded up front and cells with unbounded neighbors are not valid."""
+        rows=np.repeat(self.indices,np.diff(self.neighbor_indptr))
+        self.shell_bool=np.copy(self.inner_bool)
+        self.shell_bool[self.neighbor_indices[self.inner_bool[rows]]]=True
+        self.needed_bool=np.logical_and(self.shell_bool,self.bounded_bool)
+        self.needed_indices=self.indices[self.needed_bool]
         
     def calc_inner_outer_indices(self):
         """calculate indices to choose inner volume datapoints or outer volume datapoints"""
@@ -87,127 +247,527 @@ class MixedCrystalSignature:
     
         self.inner_bool=np.all(bool_matrix,axis=1)
         self.calc_inner_outer_indices()
+        self.reset_stages('needed_cells')
         
     def set_inner_bool_vec(self,bool_vec):
         """define inner volume with a customized array of booleans
         length of bool_vec needs to be the number of rows in datapoints"""
         self.inner_bool=bool_vec
         self.calc_inner_outer_indices()
+        self.reset_stages('needed_cells')
     
     def calc_convex_hulls(self):
-        """calculate the convex hulls for all datapoints"""
-        regions=self.voro.regions
-        point_region=self.voro.point_region
-        vertices=self.voro.vertices
-        voro_points_list=[vertices[regions[point_region[i]]] for i in self.indices]
-        
-        if self.p is not None:
-            self.conv_hulls= self.p.map(partial(ConvexHull,qhull_options="QJ"),voro_points_list,chunksize=400)
-        else:
-            self.conv_hulls=[ConvexHull(voro_points_list[i],qhull_options="QJ") for i in self.indices]
-    
-    def calc_voro_area_angles(self):
-        """calculate voronoi facet areas and normal vectors"""
-        voro_area_angles=[]
-        for hull in self.conv_hulls:
-            voro_area_angle=calc.calc_voro_area_angle(hull.simplices.shape[0],
-                                                      hull.equations[:,0:3],
-                                                      hull.simplices,hull.points)
-            voro_area_angles.append(voro_area_angle)
-        return voro_area_angles
+        """calculate the voronoi cell geometry for all needed datapoints from the voronoi ridges
+        Every ridge polygon is triangulated once and shared by the two cells it separates,
+        the facet normal is the direction between the two generating points.
+        Facets are stored aligned with the neighbor graph: facet k of particle i
+        belongs to the ridge between i and neighbor_indices[k].
+        Cells calculated before for the same neighbor graph (geometry_bool) are reused,
+        so changing the inner volume only adds the geometry of newly needed cells."""
+        n_points=self.datapoints.shape[0]
+        if self.geometry_bool is None:
+            n_facets=self.neighbor_indices.shape[0]
+            self.facet_areas=np.zeros(n_facets,dtype=self.facet_dtype)
+            self.facet_normals=np.zeros((n_facets,3),dtype=self.facet_dtype)
+            self.total_areas=np.full(n_points,np.nan,dtype=self.facet_dtype)
+            self.voro_vols=np.full(n_points,np.nan,dtype=np.float64)
+            self.geometry_bool=np.zeros(n_points,dtype=np.bool)
+        new_bool=self.needed_bool&np.invert(self.geometry_bool)
+        if not np.any(new_bool):
+            return
+        if self.voro is None: #state loaded by load_state, the ridges need the tessellation again
+            self.calc_voro()
+        if self.ridge_areas is None:
+            self.ridge_areas=np.full(self.voro.ridge_points.shape[0],np.nan,dtype=np.float64)
         
+        new_facets=np.repeat(new_bool,np.diff(self.neighbor_indptr))
+        ridge_bool=np.zeros(self.voro.ridge_points.shape[0],dtype=np.bool)
+        ridge_bool[self.neighbor_ridges[new_facets]]=True
+        ridge_list=np.flatnonzero(ridge_bool&np.isnan(self.ridge_areas))
+        ridge_areas=calc.calc_ridge_areas(self.voro.vertices,self.ridge_indptr,self.ridge_vertices,ridge_list)
+        self.ridge_areas[ridge_list]=ridge_areas[ridge_list]
+        calc.calc_facet_geometry_rows(self.neighbor_indptr, self.neighbor_indices, self.neighbor_ridges,
+                                      self.ridge_areas, self.datapoints, self.indices[new_bool], self.box_lengths,
+                                      self.facet_areas, self.facet_normals, self.total_areas, self.voro_vols)
+        self.geometry_bool|=new_bool
+
+    def init_qlm_arrays(self,l_vec):
+        """allocate empty qlm_arrays for all l in l_vec"""
+        self.qlm_l_vec=l_vec
+        self.qlm_offsets=dict()
+        len_qlm=0
+        for l in self.qlm_l_vec:
+            self.qlm_offsets[l]=len_qlm
+            len_qlm+=2*l+1
+        self.qlm_arrays=np.zeros((self.datapoints.shape[0],len_qlm),dtype=self.qlm_dtype)
+        self.qlm_bool=np.zeros(self.datapoints.shape[0],dtype=np.bool)
+
+    def calc_qlm(self,l_vec=None):
+        """calculate qlm from minkowski structure metric for all needed cells
+        for all l in l_vec (default: L_VEC), requires the voronoi cell geometry
+        rows calculated before for all l in l_vec (qlm_bool) are reused and keep their qlm_l_vec
+        Description in https://doi.org/10.1103/PhysRevE.96.011301"""
+        if l_vec is None:
+            l_vec=self.L_VEC
+        l_vec=np.array(l_vec,dtype=np.int32)
+        if self.qlm_bool is None or not np.all(np.isin(l_vec,self.qlm_l_vec)):
+            self.init_qlm_arrays(l_vec)
+        new_bool=self.needed_bool&np.invert(self.qlm_bool)
+        if not np.any(new_bool):
+            return
+        calc.calc_msm_qlm_rows(self.qlm_l_vec,
+                               self.indices[new_bool],
+                               self.neighbor_indptr,
+                               self.facet_normals,
+                               self.facet_areas,
+                               self.total_areas,
+                               self.qlm_arrays)
+        self.qlm_bool|=new_bool
+    
     def calc_qlm_array(self):
-        """calculate qlm from minkowski structure metric
+        """calculate qlm from minkowski structure metric including all geometry stages
         Description in https://doi.org/10.1103/PhysRevE.96.011301"""
-        self.calc_voro()
-        self.calc_neighborlist()
-        self.calc_convex_hulls()
-        self.voro_area_angles=self.calc_voro_area_angles()
-        
-        self.total_areas=[hull.area for hull in self.conv_hulls]
-        self.voro_vols=[hull.volume for hull in self.conv_hulls]
+        self.calc_stages(['qlm'])
+    
+    def reset_stages(self,stage=None):
+        """forget the memoized results of stage and all stages depending on it
+        (all stages by default)"""
+        if stage is None:
+            self.computed_stages=set()
+            return
+        outdated={stage}
+        for later_stage,dependencies in self.STAGE_DEPENDENCIES.items():
+            if outdated.intersection(dependencies):
+                outdated.add(later_stage)
+        self.computed_stages-=outdated
+    
+    def calc_stages(self,stages):
+        """calculate the given stages (see STAGE_DEPENDENCIES) and all stages they depend on
+        stages that were already calculated for the current datapoints are reused"""
+        needed=set()
+        todo=list(stages)
+        while len(todo)>0:
+            stage=todo.pop()
+            if stage not in needed:
+                needed.add(stage)
+                todo.extend(self.STAGE_DEPENDENCIES[stage])
         
-        len_array=0 
-        for i in range(self.L_VEC.shape[0]): 
-            len_array += (2*self.L_VEC[i]+1) 
-            
-        self.qlm_arrays=np.zeros((len(self.total_areas),len_array),dtype=np.complex128) 
+        #the structural order alone needs only q6
+        if needed.intersection(['ql','wl']) or 'qlm' in stages:
+            qlm_l_vec=self.L_VEC
+        else:
+            qlm_l_vec=np.array([6],dtype=np.int32)
+        if 'qlm' in self.computed_stages and not np.all(np.isin(qlm_l_vec,self.qlm_l_vec)):
+            self.run_stage('qlm',lambda: self.calc_qlm(qlm_l_vec))
+        #solids are selected again if solid_thresh was changed
+        if 'solid' in self.computed_stages and self.solid_thresh!=self.stage_solid_thresh:
+            self.reset_stages('solid')
         
-        for i in range(len(self.total_areas)):
-            self.qlm_arrays[i,:]=calc.calc_msm_qlm(len_array,
-                                                   self.L_VEC,
-                                                   self.voro_area_angles[i][:,2],
-                                                   self.voro_area_angles[i][:,1],
-                                                   self.total_areas[i],
-                                                   self.voro_area_angles[i][:,0])
+        for stage in self.STAGE_DEPENDENCIES:
+            if stage not in needed or stage in self.computed_stages:
+                continue
+            if stage=='qlm':
+                self.run_stage(stage,lambda: self.calc_qlm(qlm_l_vec))
+            elif stage in ('ql','wl'):
+                msm_features=[feature for feature in ('ql','wl')
+                              if feature in needed and feature not in self.computed_stages]
+                self.run_stage('+'.join(msm_features),lambda: self.calc_msm(msm_features))
+                self.computed_stages.update(msm_features)
+            else:
+                self.run_stage(stage,getattr(self,self.STAGE_METHODS[stage]))
+            self.computed_stages.add(stage)
+    
+    def run_stage(self,stage,call):
+        """call the calculation of stage, recorded by the profiler if profiling is enabled"""
+        if self.profiler is None:
+            return call()
+        result=self.profiler.run(stage,call)
+        self.profiler.counters.update(self.get_stage_counters(stage))
+        return result
+    
+    def get_stage_counters(self,stage):
+        """sizes of the results of stage for the profiler"""
+        if stage=='voro':
+            return {'points':int(self.datapoints.shape[0]),
+                    'voronoi_points':int(self.voro_points.shape[0]),
+                    'voronoi_vertices':int(self.voro.vertices.shape[0]),
+                    'voronoi_ridges':int(self.voro.ridge_points.shape[0])}
+        if stage=='neighborlist':
+            facets_per_cell=np.diff(self.neighbor_indptr)
+            return {'facets':int(self.neighbor_indices.shape[0]),
+                    'facets_per_cell_mean':float(np.mean(facets_per_cell)) if len(facets_per_cell)>0 else 0.,
+                    'facets_per_cell_max':int(np.max(facets_per_cell,initial=0)),
+                    'unbounded_cells':int(np.sum(np.invert(self.bounded_bool))),
+                    'invalid_cells':int(np.sum(np.invert(self.valid_bool)))}
+        if stage=='needed_cells':
+            return {'inner_points':int(np.sum(self.inner_bool)),
+                    'needed_cells':int(self.needed_indices.shape[0])}
+        if stage=='convex_hulls':
+            return {'geometry_cells':int(np.sum(self.geometry_bool))}
+        if stage=='qlm':
+            return {'qlm_cells':int(np.sum(self.qlm_bool))}
+        if stage=='solid':
+            return {'solid_particles':int(self.solid_indices.shape[0])}
+        return dict()
+    
+    def enable_profiling(self,trace_memory=False):
+        """record calls, wall time (and peak memory) of every stage and counters of their results
+        (points, voronoi ridges, facets per cell, unbounded cells, solid particles,
+        numba compilations, ...) until disable_profiling, returns the signature.profiling.StageProfiler"""
+        self.profiler=profiling.StageProfiler(trace_memory)
+        self.profiler.start()
+        return self.profiler
+    
+    def disable_profiling(self):
+        """stop profiling, returns the profile as dict (see StageProfiler.as_dict)"""
+        if self.profiler is None:
+            return None
+        self.profiler.stop()
+        profile=self.profiler.as_dict()
+        self.profiler=None
+        return profile
+    
+    @contextmanager
+    def profiling(self,trace_memory=False):
+        """context manager for enable_profiling and disable_profiling, e.g.
+        with sign_calculator.profiling() as profiler:
+            sign_calculator.calc_signature()
+        metrics=profiler.as_dict() #or profiler.to_json()"""
+        profiler=self.enable_profiling(trace_memory)
+        try:
+            yield profiler
+        finally:
+            self.disable_profiling()
     
     def calc_struct_order(self):
-        """calculate the structural order for every particle
+        """calculate the structural order for every insider particle
+        insiders with an unbounded cell or unbounded neighbor cells are never solid
         Description in https://doi.org/10.1103/PhysRevE.96.011301"""
         si_l=6 #this should only make sense with l=6, so its hardcoded
-        self.solid_bool=np.zeros(self.datapoints.shape[0],dtype=np.bool)
-        self.struct_order=np.zeros(self.datapoints.shape[0],dtype=np.float64)
-        for i in self.insider_indices:
-            voro_neighbors = np.array(self.neighborlist[i],dtype=np.int64)
-            qlm_array_neighbors = self.qlm_arrays[voro_neighbors][:,self.idx_qlm[si_l]]
-            num_neighbors=len(self.neighborlist[i])
-            si=calc.calc_si(6,self.qlm_arrays[i,self.idx_qlm[si_l]],num_neighbors,qlm_array_neighbors)
-            self.solid_bool[i]=(si>=self.solid_thresh)
-            self.struct_order[i]=si
-        self.solid_indices=self.indices[np.logical_and(self.inner_bool,self.solid_bool)]
+        si_bool=np.logical_and(self.inner_bool,self.valid_bool)
+        self.struct_order=calc.calc_si_arrays(si_l,self.qlm_offsets[si_l],self.qlm_arrays,
+                                              self.indices[si_bool],self.neighbor_indptr,self.neighbor_indices)
+    
+    def calc_solid_indices(self):
+        """select the solid particles: valid insiders with a structural order of at least solid_thresh"""
+        si_bool=np.logical_and(self.inner_bool,self.valid_bool)
+        self.solid_bool=np.logical_and(si_bool,self.struct_order>=self.solid_thresh)
+        self.solid_indices=self.indices[self.solid_bool]
+        self.stage_solid_thresh=self.solid_thresh
     
     def calc_num_neigh(self):
         """calculate the number of neighbors for all solid particles"""
-        self.signature['N']=[len(self.neighborlist[i]) for i in self.solid_indices]
+        self.signature_matrix[:,self.signature_slices['N']]=np.diff(self.neighbor_indptr)[self.solid_indices,np.newaxis]
     
-    def calc_msm(self):
-        """calculate ql from minkowski structure metric for all solid particles
+    def calc_msm(self,features=('ql','wl')):
+        """calculate ql and wl from minkowski structure metric for all solid particles
+        the Wigner-3J symbols are only needed if wl is in features
         Description in https://doi.org/10.1103/PhysRevE.96.011301"""
-        ql_array=calc.calc_qls_from_qlm_arrays(self.L_VEC,self.qlm_arrays[self.solid_indices]).transpose()
-        for l in self.L_VEC:
-            self.signature['q{:d}'.format(l)]=ql_array[self.L_VEC==l][0]
-        
-        wigner_arr,m_arr,count_arr=calc.calc_wigner3j_general(self.L_VEC)
-        wl_array=calc.calc_wls_from_qlm_arrays(self.L_VEC,self.qlm_arrays[self.solid_indices],wigner_arr,m_arr,count_arr).transpose()
-        for l in self.L_VEC:
-            if l%2==0: #odd number w_l are useless
-                self.signature['w{:d}'.format(l)]=wl_array[self.L_VEC==l][0]
+        if 'wl' in features:
+            wigner_arr,m_arr,count_arr=calc.calc_wigner3j_reduced(self.L_VEC)
+        else:
+            wigner_arr=np.zeros(0,dtype=np.float64)
+            m_arr=np.zeros((0,3),dtype=np.int32)
+            count_arr=np.zeros(self.L_VEC.shape[0],dtype=np.int32)
+        #the kernel expects the qlm of L_VEC in this order, rows kept for other l are rearranged
+        if np.array_equal(self.qlm_l_vec,self.L_VEC):
+            qlm_arrays=self.qlm_arrays
+            point_list=self.solid_indices
+        else:
+            columns=np.concatenate([self.qlm_offsets[l]+np.arange(2*l+1) for l in self.L_VEC])
+            qlm_arrays=self.qlm_arrays[np.ix_(self.solid_indices,columns)]
+            point_list=np.arange(self.solid_indices.shape[0],dtype=self.solid_indices.dtype)
+        ql_array,wl_array=calc.calc_qls_wls_from_qlm_arrays(self.L_VEC,qlm_arrays,point_list,
+                                                             wigner_arr,m_arr,count_arr)
+        if 'ql' in features:
+            self.signature_matrix[:,self.signature_slices['ql']]=ql_array
+        if 'wl' in features:
+            self.signature_matrix[:,self.signature_slices['wl']]=wl_array[:,self.L_VEC%2==0] #odd number w_l are useless
+    
+    def calc_bond_angle_distance_hists(self):
+        """calculate bond angle and normalized distance histograms for all solid particles
+        in a single pass over the neighbor pairs"""
+        self.bond_angles,self.hist_distances=calc.calc_bond_angle_distance_hists(self.solid_indices,
+                                                                                 self.neighbor_indptr,
+                                                                                 self.neighbor_indices,
+                                                                                 self.datapoints,
+                                                                                 self.voro_vols,
+                                                                                 calc.ANGLE_EDGES,
+                                                                                 self.box_lengths)
     
     def calc_bond_angles(self):
-        """calculate bond angles for all solid particles
+        """add bond angle histograms of all solid particles to the signature
         definition in: https://doi.org/10.1103/PhysRevB.73.054104"""
-        bond_angles=calc.calc_bond_angles(self.solid_indices,self.neighborlist,self.datapoints)
-        for dim in range(bond_angles.shape[1]):
-            self.signature['ba{:d}'.format(dim)]=bond_angles[:,dim]
+        self.signature_matrix[:,self.signature_slices['ba']]=self.bond_angles
         
     def calc_hist_distances(self):
-        """calculate histogram of normalized distances
+        """add histograms of normalized distances of all solid particles to the signature
         Modified from https://doi.org/10.1103/PhysRevE.96.011301"""
-        hist_distances=calc.calc_hist_distances(self.solid_indices,self.neighborlist,self.datapoints,self.voro_vols)
-        for dim in range(hist_distances.shape[1]):
-            self.signature['dist{:d}'.format(dim)]=hist_distances[:,dim]
+        self.signature_matrix[:,self.signature_slices['dist']]=self.hist_distances
 
     def calc_minkowski_eigvals(self):
         """calculate eigenvalues of rank 4 minkowski tensor for all solid particles
         Description in https://doi.org/10.1103/PhysRevE.85.030301"""
-        eigenvals_arr=np.zeros((self.solid_indices.shape[0],6),dtype=np.float64)
-        for idx in range(self.solid_indices.shape[0]):
-            i=self.solid_indices[idx]
-            eigenvals_arr[idx]=calc.calc_minkowski_eigenvalues(self.total_areas[i],
-                                                               self.voro_area_angles[i][:,0],
-                                                               self.conv_hulls[i].equations[:,0:3])
-        for dim in range(eigenvals_arr.shape[1]):
-            self.signature['zeta{:d}'.format(dim)]=eigenvals_arr[:,dim]
-
-    def calc_signature(self):
+        eigenvals_arr=calc.calc_minkowski_eigenvalues(self.solid_indices,
+                                                      self.neighbor_indptr,
+                                                      self.facet_normals,
+                                                      self.facet_areas,
+                                                      self.total_areas)
+        self.signature_matrix[:,self.signature_slices['zeta']]=eigenvals_arr
+
+    def init_signature_matrix(self):
+        """allocate the signature_matrix for all solid particles, features not calculated are nan"""
+        self.signature_matrix=np.full((self.solid_indices.shape[0],len(self.signature_columns)),np.nan,
+                                      dtype=self.signature_dtype)
+
+    def calc_signature(self,features=None):
         """Function to calculate the mixed crystal signature on the dataset
-        Description in https://doi.org/10.1103/PhysRevE.96.011301 (with minor modifications)"""
-        self.signature=pd.DataFrame()
-        
-        self.calc_qlm_array()
-        self.calc_struct_order()
-        self.calc_num_neigh()
-        self.calc_bond_angles()
-        self.calc_msm()
-        self.calc_minkowski_eigvals()
-        self.calc_hist_distances()
+        Description in https://doi.org/10.1103/PhysRevE.96.011301 (with minor modifications)
+        The features of all solid particles are written into the preallocated signature_matrix
+        (columns see signature_columns), signature is a DataFrame view of it.
+        features optionally restricts the calculation to a list of FEATURE_GROUPS
+        (e.g. [] for the structural order only), only the stages they depend on are calculated.
+        Stages are memoized until set_datapoints or set_box, so later calls for the same
+        datapoints only calculate missing features. After a change of solid_thresh or the
+        inner volume only the structural order and the features are calculated again
+        (plus the cell geometry of newly needed cells)."""
+        if features is None:
+            features=self.FEATURE_GROUPS
+        self.calc_stages(['struct_order','signature_matrix']+list(features))
+
+    def save_state(self,path):
+        """save datapoints, inner volume, neighbor graph, cell geometry and qlm to a compressed .npz file
+        load_state restores them, so the signature of stored frames can be calculated again
+        (e.g. for other inner volumes or solid_thresh) without the tessellation"""
+        self.calc_stages(['qlm'])
+        np.savez_compressed(path,
+                            datapoints=self.datapoints,
+                            box=np.zeros((0,2)) if self.box is None else self.box,
+                            halo=np.nan if self.halo is None else self.halo,
+                            inner_bool=self.inner_bool,
+                            neighbor_indptr=self.neighbor_indptr,
+                            neighbor_indices=self.neighbor_indices,
+                            neighbor_ridges=self.neighbor_ridges,
+                            bounded_bool=self.bounded_bool,
+                            valid_bool=self.valid_bool,
+                            geometry_bool=self.geometry_bool,
+                            facet_areas=self.facet_areas,
+                            facet_normals=self.facet_normals,
+                            total_areas=self.total_areas,
+                            voro_vols=self.voro_vols,
+                            qlm_l_vec=self.qlm_l_vec,
+                            qlm_bool=self.qlm_bool,
+                            qlm_rows=self.qlm_arrays[self.qlm_bool])
+
+    def load_state(self,path):
+        """load a state saved by save_state, the tessellation is only repeated
+        if cells outside of the saved geometry are needed later,
+        the saved qlm are only reused if they include every l of L_VEC"""
+        with np.load(path) as state:
+            self.set_datapoints(state['datapoints'])
+            box=state['box']
+            halo=float(state['halo'])
+            self.set_box(None if box.shape[0]==0 else box,None if np.isnan(halo) else halo)
+            self.set_inner_bool_vec(state['inner_bool'])
+            self.voro=None
+            self.neighbor_indptr=state['neighbor_indptr']
+            self.neighbor_indices=state['neighbor_indices']
+            self.neighbor_ridges=state['neighbor_ridges']
+            self.bounded_bool=state['bounded_bool']
+            self.valid_bool=state['valid_bool']
+            self.ridge_areas=None
+            self.geometry_bool=state['geometry_bool']
+            self.facet_areas=state['facet_areas'].astype(self.facet_dtype,copy=False)
+            self.facet_normals=state['facet_normals'].astype(self.facet_dtype,copy=False)
+            self.total_areas=state['total_areas'].astype(self.facet_dtype,copy=False)
+            self.voro_vols=state['voro_vols']
+            #qlm saved without every l of L_VEC are recalculated
+            if np.all(np.isin(self.L_VEC,state['qlm_l_vec'])):
+                self.init_qlm_arrays(state['qlm_l_vec'])
+                self.qlm_bool=state['qlm_bool']
+                self.qlm_arrays[self.qlm_bool]=state['qlm_rows']
+            else:
+                self.qlm_bool=None
+        self.computed_stages={'voro','neighborlist'}
+
+    def classify(self,classifier=None,batch_size=65536):
+        """predict the crystal structure of every datapoint from the signature
+        (calculated before with all features by calc_signature or calc_signature_tiled)
+        classifier is a signature.classification.NumpyMLPClassifier, by default the pretrained one.
+        Returns labels for all datapoints, 0 for particles that are not solid
+        (labels of solids see CrystalAnalyzer.LABELS2STRUCT)"""
+        if classifier is None:
+            classifier=classification.load_pretrained()
+        labels=np.zeros(self.datapoints.shape[0],dtype=np.int32)
+        labels[self.solid_indices]=classifier.predict(self.signature_matrix,batch_size)
+        return labels
+
+    def calc_signature_tiled(self,tiles=(2,2,2),halo=None,tiles_per_batch=16):
+        """calculate the mixed crystal signature tile by tile for very large datasets
+        The datapoints (or the periodic box, see set_box) are split into tiles[0]*tiles[1]*tiles[2]
+        sub-boxes, every tile is tessellated with a halo of surrounding particles
+        (default: four mean particle distances) and tiles are calculated in the pool if one is provided.
+        The halo of a tile is enlarged until all voronoi cells its results depend on are exact,
+        i.e. no other particle lies in the empty spheres of their vertices. In open point clouds
+        cells at the surface reach far out, insiders should keep a few particle distances from it.
+        signature_matrix, struct_order, solid_bool, solid_indices and voro_vols (insiders only) are
+        stitched together by global index, memory of a worker scales with the tile size.
+        Intermediate results of the tessellation (voro, qlm_arrays, ...) are not kept and the memoized
+        stages of calc_signature are reset, so a later calc_signature starts from the tessellation."""
+        from scipy.spatial import ConvexHull, cKDTree
+        start_time=time.perf_counter()
+        n_points=self.datapoints.shape[0]
+        if self.box is None:
+            region_min=np.min(self.datapoints,axis=0)
+            region_max=np.max(self.datapoints,axis=0)
+            tree=cKDTree(self.datapoints)
+            hull=ConvexHull(self.datapoints,qhull_options='Qc')
+            hull_bool=np.zeros(n_points,dtype=np.bool)
+            hull_bool[hull.vertices]=True
+            hull_bool[hull.coplanar[:,0]]=True
+        else:
+            region_min=self.box[:,0]
+            region_max=self.box[:,1]
+            tree=cKDTree(calc.calc_box_coordinates(self.datapoints,self.box),boxsize=self.box_lengths)
+        tiles=np.array(tiles,dtype=np.int64)
+        tile_size=(region_max-region_min)/tiles
+        if halo is None:
+            halo=4*(np.prod(region_max-region_min)/n_points)**(1/3)
+
+        #the tiled results replace the memoized stages of calc_signature
+        self.reset_stages()
+        self.ridge_areas=None
+        self.geometry_bool=None
+        self.qlm_bool=None
+        self.struct_order=np.zeros(n_points,dtype=np.float64)
+        self.voro_vols=np.full(n_points,np.nan,dtype=np.float64)
+        self.solid_bool=np.zeros(n_points,dtype=np.bool)
+        solid_list=[np.zeros(0,dtype=np.int64)]
+        signature_list=[np.zeros((0,len(self.signature_columns)),dtype=self.signature_dtype)]
+        
+        todo=[tile for tile in np.ndindex(*tiles)]
+        tile_retries=0
+        while len(todo)>0:
+            if self.box is None:
+                points,images=self.datapoints,self.indices
+            else:
+                if halo>=np.min(self.box_lengths):
+                    raise ValueError('periodic box is too small for the needed halo of {:f}'.format(halo))
+                points,images=calc.calc_periodic_images(self.datapoints,self.box,halo)
+                hull_bool=np.zeros(points.shape[0],dtype=np.bool)
+            core_tiles=np.clip(np.floor((points-region_min)/tile_size).astype(np.int64),0,tiles-1)
+            core_flat=np.ravel_multi_index(core_tiles.T,tiles)
+            core_order=np.argsort(core_flat,kind='stable')
+            core_starts=np.searchsorted(core_flat[core_order],np.arange(np.prod(tiles)+1))
+            reach=np.ceil(halo/tile_size).astype(np.int64)
+            
+            failed=[]
+            for start in range(0,len(todo),tiles_per_batch):
+                batch=[]
+                members_list=[]
+                args_list=[]
+                for tile in todo[start:start+tiles_per_batch]:
+                    tile_index=tile
+                    tile=np.array(tile)
+                    core_min=region_min+tile*tile_size
+                    core_max=core_min+tile_size
+                    candidates=[]
+                    for neighbor_tile in np.ndindex(*(2*reach+1)):
+                        neighbor_tile=tile+np.array(neighbor_tile)-reach
+                        if np.any(neighbor_tile<0) or np.any(neighbor_tile>=tiles):
+                            continue
+                        neighbor_flat=np.ravel_multi_index(neighbor_tile,tiles)
+                        candidates.append(core_order[core_starts[neighbor_flat]:core_starts[neighbor_flat+1]])
+                    candidates=np.sort(np.concatenate(candidates))
+                    members=candidates[np.all((points[candidates]>=core_min-halo)&
+                                              (points[candidates]<=core_max+halo),axis=1)]
+                    inner_bool=((core_flat[members]==np.ravel_multi_index(tile,tiles))&
+                                (members<n_points))
+                    inner_bool[inner_bool]=self.inner_bool[images[members[inner_bool]]]
+                    #tiles without insiders have no results, sparse tiles need a larger halo
+                    #for the tessellation (qhull needs at least 5 points)
+                    if not np.any(inner_bool):
+                        continue
+                    if members.shape[0]<5:
+                        if members.shape[0]<points.shape[0]:
+                            failed.append(tile_index)
+                        continue
+                    batch.append(tile_index)
+                    members_list.append(members)
+                    args_list.append((points[members],inner_bool,hull_bool[members],core_min-halo,core_max+halo,
+                                      self.solid_thresh,self.L_VEC,self.signature_dtype,self.precision))
+                
+                if self.p is not None:
+                    results=self.p.map(calc_tile_signature,args_list)
+                else:
+                    results=map(calc_tile_signature,args_list)
+                
+                for tile,members,result in zip(batch,members_list,results):
+                    cut,centers,radii,insiders,struct_order,voro_vols,solid_indices,signature=result
+                    #empty spheres reaching out of the tile must not contain any other point
+                    if self.box is not None:
+                        centers=calc.calc_box_coordinates(centers,self.box)
+                    if cut or np.any(tree.query(centers)[0]<radii*(1-1e-10)):
+                        failed.append(tile)
+                        continue
+                    global_indices=images[members]
+                    self.struct_order[global_indices[insiders]]=struct_order
+                    self.voro_vols[global_indices[insiders]]=voro_vols
+                    solid_list.append(global_indices[solid_indices])
+                    signature_list.append(signature)
+            todo=failed
+            tile_retries+=len(failed)
+            halo*=1.5
+        
+        solid_indices=np.concatenate(solid_list)
+        solid_order=np.argsort(solid_indices)
+        self.solid_indices=solid_indices[solid_order].astype(np.int32)
+        self.solid_bool[self.solid_indices]=True
+        self.signature_matrix=np.concatenate(signature_list,axis=0)[solid_order]
+        if self.profiler is not None:
+            self.profiler.add_stage('tiled',time.perf_counter()-start_time)
+            self.profiler.counters.update({'points':int(n_points),
+                                           'tiles':int(np.prod(tiles)),
+                                           'tile_retries':tile_retries,
+                                           'solid_particles':int(self.solid_indices.shape[0])})
+
+def warmup(l_vec=None,precision='double'):
+    """prepare a process for fast signature calculations, e.g. as initializer of a pool:
+    multiprocessing.Pool(processes,initializer=warmup)
+    The numba kernels are compiled at import (or loaded from the on-disk cache), this calculates
+    the signature of a small noisy fcc crystal once, so scipy is imported, the Wigner-3J symbols
+    of l_vec are loaded and the numba threading layer is started. Returns the duration in seconds."""
+    start_time=time.perf_counter()
+    datapoints=gcn.fill_volume_fcc(5,5,5)
+    datapoints=datapoints+np.random.default_rng(0).normal(scale=0.02,size=datapoints.shape)
+    sign_calculator=MixedCrystalSignature(l_vec=l_vec,precision=precision)
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_inner_volume([[1.5,3.5],[1.5,3.5],[1.5,3.5]])
+    sign_calculator.calc_signature()
+    return time.perf_counter()-start_time
+
+def calc_tile_signature(args):
+    """calculate the signature of a single tile for MixedCrystalSignature.calc_signature_tiled
+    returns whether needed cells are cut by the tile, the empty spheres of the needed cells
+    reaching out of the tile and the results of the insiders"""
+    tile_points,inner_bool,hull_bool,tile_min,tile_max,solid_thresh,l_vec,signature_dtype,precision=args
+    sign_calculator=MixedCrystalSignature(solid_thresh=solid_thresh,l_vec=l_vec,signature_dtype=signature_dtype,
+                                          precision=precision)
+    sign_calculator.set_datapoints(tile_points)
+    sign_calculator.set_inner_bool_vec(inner_bool)
+    sign_calculator.calc_signature()
+    
+    #cells unbounded in the tile but not on the hull of the whole dataset are cut by the tile
+    cut_bool=sign_calculator.shell_bool&np.invert(sign_calculator.bounded_bool)&np.invert(hull_bool)
+    #results depend on the cells of bounded insiders and the neighbor cells of valid insiders only
+    check_bool=sign_calculator.inner_bool&sign_calculator.bounded_bool
+    rows=np.repeat(sign_calculator.indices,np.diff(sign_calculator.neighbor_indptr))
+    check_bool[sign_calculator.neighbor_indices[(check_bool&sign_calculator.valid_bool)[rows]]]=True
+    centers,radii=calc.calc_cell_spheres(sign_calculator.voro_points,sign_calculator.voro.vertices,
+                                         sign_calculator.voro.ridge_points,sign_calculator.ridge_indptr,
+                                         sign_calculator.ridge_vertices,check_bool)
+    outside=np.any((centers-radii[:,np.newaxis]<tile_min)|(centers+radii[:,np.newaxis]>tile_max),axis=1)
+    
+    insiders=sign_calculator.insider_indices
+    return (np.any(cut_bool),centers[outside],radii[outside],insiders,sign_calculator.struct_order[insiders],sign_calculator.voro_vols[insiders],
+            sign_calculator.solid_indices,sign_calculator.signature_matrix)
@@ -6,280 +6,547 @@ Created on Fri Aug  3 11:10:35 2018
 @author: dietz
 """
 
-from math import sqrt, atan2, acos, pi
+import os
+from math import sqrt, pi, floor
+from itertools import chain, product
 import numpy as np
 import numba
-from sphericalharmonics.sphharmhard import sph_harm_hard
-from sympy.physics.wigner import wigner_3j
-from sympy import N
-
-@numba.njit(numba.float64(numba.float64[:], numba.float64[:]))
-def calc_area(u, v):
-    """calculates the area between two vectors u and v"""
-    cx = u[1]*v[2]-u[2]*v[1]
-    cy = u[2]*v[0]-u[0]*v[2]
-    cz = u[0]*v[1]-u[1]*v[0]
-
-    return 0.5*sqrt(cx**2+cy**2+cz**2)
-
-@numba.njit(numba.float64[:, :](numba.int64, numba.float64[:, :], numba.int32[:, :], numba.float64[:, :]))
-def calc_voro_area_angle(n_faces, norm_vecs, simpls, points):
-    """calculates areas of voronoi facets and azumimuthal and polar angles of the facet normals"""
-    u_vec = np.zeros((3, ), dtype=np.float64)
-    v_vec = np.zeros((3, ), dtype=np.float64)
-    result_array = np.zeros((n_faces, 3), dtype=np.float64)
-    for i in range(n_faces):
-        for j in range(3):
-            u_vec[j] = points[simpls[i, 1], j]-points[simpls[i, 0], j]
-            v_vec[j] = points[simpls[i, 2], j]-points[simpls[i, 0], j]
-        result_array[i, 0] = calc_area(u_vec, v_vec)
-        #phi - azimuthal angle
-        result_array[i, 1] = atan2(norm_vecs[i, 1], norm_vecs[i, 0])%(2*pi)
-        #theta - polar angle
-        result_array[i, 2] = acos(norm_vecs[i, 2])
-
-    return result_array
-
-@numba.njit(numba.complex128[:](numba.int64, numba.int32[:], numba.float64[:], numba.float64[:], numba.float64, numba.float64[:]))
-def calc_msm_qlm(len_array, l_vec, theta_vec, phi_vec, total_area, areas):
-    """calculates the minkowski structure metric (MSM) from voronoi areas and angles
+from sphericalharmonics.sphharmrecurrence import sph_harm_recurrence, sph_harm_index
+
+#precomputed Wigner-3J symbols, regenerate with generate_wigner3j_table
+WIGNER3J_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wigner3j.npz')
+wigner3j_l_cache = dict()
+wigner3j_cache = dict()
+wigner3j_reduced_cache = dict()
+
+#bins of the bond angle (cosine) and normalized distance histograms
+ANGLE_EDGES = np.array([-1.05, -0.945, -0.915, -0.755, -0.195, 0.195, 0.245, 0.795, 1.05])
+NBINS_DISTANCES = 12
+DISTANCE_RANGE = (0.65, 3.1)
+
+def calc_neighbor_csr(ridge_points, n_points, point_images=None):
+    """builds a compressed sparse row (CSR) neighbor graph from voronoi ridge points
+
+    Returns int32 arrays indptr, indices and ridges, neighbors of point i are
+    indices[indptr[i]:indptr[i+1]] sorted in ascending order and ridges holds
+    the index of the voronoi ridge shared with each neighbor.
+    With point_images (periodic ghost images, see calc_periodic_images) only the first
+    n_points points get rows and ghost neighbors are mapped to their original index.
+    """
+    n_ridges = ridge_points.shape[0]
+    rows = np.concatenate((ridge_points[:, 0], ridge_points[:, 1])).astype(np.int64)
+    cols = np.concatenate((ridge_points[:, 1], ridge_points[:, 0])).astype(np.int64)
+    ridges = np.concatenate((np.arange(n_ridges), np.arange(n_ridges)))
+    if point_images is not None:
+        own_bool = rows < n_points
+        rows = rows[own_bool]
+        cols = point_images[cols[own_bool]].astype(np.int64)
+        ridges = ridges[own_bool]
+    keys, first = np.unique(rows*n_points+cols, return_index=True)
+    if point_images is not None and keys.shape[0] < rows.shape[0]:
+        raise ValueError('periodic box is too small, a particle neighbors several images of the same particle')
+    indices = (keys % n_points).astype(np.int32)
+    ridges = ridges[first].astype(np.int32)
+    indptr = np.zeros(n_points+1, dtype=np.int32)
+    np.cumsum(np.bincount(keys // n_points, minlength=n_points), out=indptr[1:])
+    return indptr, indices, ridges
+
+def flatten_ridge_vertices(ridge_vertices):
+    """flattens the voronoi ridge vertex lists into CSR arrays indptr and vertices"""
+    lengths = np.fromiter(map(len, ridge_vertices), dtype=np.int32, count=len(ridge_vertices))
+    indptr = np.zeros(lengths.shape[0]+1, dtype=np.int32)
+    np.cumsum(lengths, out=indptr[1:])
+    vertices = np.fromiter(chain.from_iterable(ridge_vertices), dtype=np.int32, count=indptr[-1])
+    return indptr, vertices
+
+def calc_box_coordinates(points, box):
+    """wraps points into the periodic box, returns coordinates relative to the lower corner in [0, box_length)"""
+    box_lengths = box[:, 1]-box[:, 0]
+    coordinates = np.mod(points-box[:, 0], box_lengths)
+    # np.mod rounds tiny negative differences up to the box length
+    return np.where(coordinates < box_lengths, coordinates, 0.)
+
+def calc_periodic_images(datapoints, box, halo):
+    """wraps datapoints into the periodic box and appends ghost images of all points within halo of a face
+
+    Returns the points followed by their ghost images and for every returned point the index
+    of the original point (identity for the first len(datapoints) entries).
+    """
+    box_min = box[:, 0]
+    box_lengths = box[:, 1]-box[:, 0]
+    wrapped = box_min+np.mod(datapoints-box_min, box_lengths)
+    near_min = wrapped < box_min+halo
+    near_max = wrapped >= box[:, 1]-halo
+
+    points = [wrapped]
+    images = [np.arange(datapoints.shape[0], dtype=np.int32)]
+    for shift in product((-1, 0, 1), repeat=3):
+        if shift == (0, 0, 0):
+            continue
+        shift_bool = np.ones(datapoints.shape[0], dtype=np.bool_)
+        for dim in range(3):
+            if shift[dim] == 1:
+                shift_bool &= near_min[:, dim]
+            elif shift[dim] == -1:
+                shift_bool &= near_max[:, dim]
+        shift_indices = np.flatnonzero(shift_bool).astype(np.int32)
+        points.append(wrapped[shift_indices]+np.array(shift)*box_lengths)
+        images.append(shift_indices)
+    return np.concatenate(points), np.concatenate(images)
+
+def calc_cell_spheres(points, vertices, ridge_points, indptr, ridge_vertices, point_bool):
+    """calculates the empty spheres of the voronoi cells of all points with point_bool
+
+    Every vertex of a cell is the center of an empty sphere through the generating point.
+    Returns centers and radii of all spheres, None if one of the cells is unbounded.
+    """
+    own_ridges = np.flatnonzero(point_bool[ridge_points[:, 0]] | point_bool[ridge_points[:, 1]])
+    lengths = np.diff(indptr)[own_ridges]
+    offsets = np.repeat(indptr[own_ridges]-np.cumsum(lengths)+lengths, lengths)
+    own_vertices = ridge_vertices[np.arange(offsets.shape[0])+offsets]
+    if np.any(own_vertices < 0):
+        return None
+    centers = vertices[own_vertices]
+    radii = np.linalg.norm(centers-points[np.repeat(ridge_points[own_ridges, 0], lengths)], axis=1)
+    return centers, radii
+
+def check_cells_exact(points, vertices, ridge_points, indptr, ridge_vertices, point_bool, region_min, region_max):
+    """checks that the voronoi cells of all points with point_bool are exact
+
+    The cells are exact if all their empty spheres lie inside the region where all points are known.
+    """
+    spheres = calc_cell_spheres(points, vertices, ridge_points, indptr, ridge_vertices, point_bool)
+    if spheres is None:
+        return False
+    centers, radii = spheres
+    radii = radii[:, np.newaxis]
+    return bool(np.all(centers-radii >= region_min) and np.all(centers+radii <= region_max))
 
+def calc_unbounded_points(ridge_points, indptr, ridge_vertices, n_points):
+    """finds the points with unbounded voronoi cells
+
+    A cell is unbounded if one of its ridges contains the vertex at infinity (-1).
+    """
+    unbounded_ridges = np.minimum.reduceat(ridge_vertices, indptr[:-1]) < 0
+    unbounded_bool = np.zeros(n_points, dtype=np.bool_)
+    unbounded_bool[ridge_points[unbounded_ridges].ravel()] = True
+    return unbounded_bool
+
+@numba.njit(numba.float64(numba.float64, numba.float64), nogil=True, cache=True)
+def min_image(delta, box_length):
+    """minimum image convention for a coordinate difference, a box_length of 0 means not periodic"""
+    if box_length > 0.:
+        return delta-box_length*floor(delta/box_length+0.5)
+    return delta
+
+@numba.njit(numba.float64[:](numba.float64[:, :], numba.int32[:], numba.int32[:], numba.int64[:]), cache=True)
+def calc_ridge_areas(vertices, indptr, ridge_vertices, ridge_list):
+    """calculates the areas of the voronoi ridge polygons in ridge_list by triangulation
+
+    The vertices of a 3d voronoi ridge are ordered cyclically by qhull.
+    Unbounded ridges (containing vertex -1) and ridges not in ridge_list get an area of nan.
+    """
+    n_ridges = indptr.shape[0]-1
+    areas = np.full(n_ridges, np.nan, dtype=np.float64)
+    for idx in range(ridge_list.shape[0]):
+        r = ridge_list[idx]
+        start = indptr[r]
+        stop = indptr[r+1]
+        unbounded = False
+        for k in range(start, stop):
+            if ridge_vertices[k] < 0:
+                unbounded = True
+        if unbounded:
+            continue
+        v0 = ridge_vertices[start]
+        cx = 0.
+        cy = 0.
+        cz = 0.
+        for k in range(start+1, stop-1):
+            v1 = ridge_vertices[k]
+            v2 = ridge_vertices[k+1]
+            ux = vertices[v1, 0]-vertices[v0, 0]
+            uy = vertices[v1, 1]-vertices[v0, 1]
+            uz = vertices[v1, 2]-vertices[v0, 2]
+            vx = vertices[v2, 0]-vertices[v0, 0]
+            vy = vertices[v2, 1]-vertices[v0, 1]
+            vz = vertices[v2, 2]-vertices[v0, 2]
+            cx += uy*vz-uz*vy
+            cy += uz*vx-ux*vz
+            cz += ux*vy-uy*vx
+        areas[r] = 0.5*sqrt(cx**2+cy**2+cz**2)
+    return areas
+
+def facet_geometry_signature(facet_type):
+    "numba signature of calc_facet_geometry_rows for facets stored as facet_type"
+    return numba.void(numba.int32[:], numba.int32[:], numba.int32[:], numba.float64[:], numba.float64[:, :],
+                      numba.int32[:], numba.float64[:], facet_type[:], facet_type[:, :], facet_type[:],
+                      numba.float64[:])
+
+@numba.njit([facet_geometry_signature(numba.float64), facet_geometry_signature(numba.float32)], cache=True)
+def calc_facet_geometry_rows(indptr, neighbors, ridges, ridge_areas, points, point_list, box_lengths,
+                             facet_areas, facet_normals, total_areas, volumes):
+    """writes facet areas, unit normals, total surface area and volume of the voronoi cells in point_list
+    into the given arrays, entries of other cells are not touched.
+
+    Facet k of point i is the ridge shared with neighbors[k], its normal points
+    from point i to the neighbor and the cell volume is the sum of the pyramids
+    spanned by the facets and the generating point.
+    The geometry is calculated in double precision, facets may be stored as float32.
+    Distances follow the minimum image convention in periodic dimensions (box_lengths > 0).
+    """
+    for idx in range(point_list.shape[0]):
+        i = point_list[idx]
+        total_area = 0.
+        volume = 0.
+        for k in range(indptr[i], indptr[i+1]):
+            area = ridge_areas[ridges[k]]
+            dx = min_image(points[neighbors[k], 0]-points[i, 0], box_lengths[0])
+            dy = min_image(points[neighbors[k], 1]-points[i, 1], box_lengths[1])
+            dz = min_image(points[neighbors[k], 2]-points[i, 2], box_lengths[2])
+            dist = sqrt(dx**2+dy**2+dz**2)
+            facet_normals[k, 0] = dx/dist
+            facet_normals[k, 1] = dy/dist
+            facet_normals[k, 2] = dz/dist
+            facet_areas[k] = area
+            total_area += area
+            volume += area*dist/6.
+        total_areas[i] = total_area
+        volumes[i] = volume
+
+def msm_qlm_signature(facet_type, qlm_type):
+    "numba signature of calc_msm_qlm_rows for facets of facet_type and qlm of qlm_type"
+    return numba.void(numba.int32[:], numba.int32[:], numba.int32[:], facet_type[:, :], facet_type[:],
+                      facet_type[:], qlm_type[:, :])
+
+@numba.njit([msm_qlm_signature(numba.float64, numba.complex128), msm_qlm_signature(numba.float32, numba.complex64)],
+            parallel=True, cache=True)
+def calc_msm_qlm_rows(l_vec, point_list, indptr, facet_normals, facet_areas, total_areas, qlm_arrays):
+    """writes the minkowski structure metric (MSM) of all points in point_list into qlm_arrays in parallel
+
+    Facets of point i are facet_normals[indptr[i]:indptr[i+1]] and facet_areas[indptr[i]:indptr[i+1]],
+    rows of points not in point_list are not touched.
+    All Y_lm up to max(l_vec) are evaluated in one recurrence pass per facet, only m >= 0 is
+    accumulated (in double precision) and negative m follow from q_l,-m = (-1)^m conj(q_lm) as the areas are real.
     Explanation is in https://doi.org/10.1063/1.4774084
     """
     len_l = l_vec.shape[0]
-    len_angles = theta_vec.shape[0]
+    lmax = np.max(l_vec)
+    len_array = qlm_arrays.shape[1]
+    for idx in numba.prange(point_list.shape[0]):
+        i = point_list[idx]
+        ylm = np.zeros((lmax+1)*(lmax+2)//2, dtype=np.complex128)
+        qlm = np.zeros(len_array, dtype=np.complex128)
+        for k in range(indptr[i], indptr[i+1]):
+            sph_harm_recurrence(lmax, facet_normals[k, 0], facet_normals[k, 1], facet_normals[k, 2], ylm)
+            index_l = 0
+            for j in range(len_l):
+                l = l_vec[j]
+                for m in range(l+1):
+                    qlm[index_l+m+l] += ylm[sph_harm_index(l, m)]*facet_areas[k]
+                index_l += 2*l+1
 
-    qlm_result = np.zeros(len_array, dtype=np.complex128)
-    for i in range(len_angles):
         index_l = 0
         for j in range(len_l):
             l = l_vec[j]
-            for m in range(-l, l+1):
-                ylm = sph_harm_hard(l, m, theta_vec[i], phi_vec[i])
-                qlm_result[index_l+m+l] += ylm*areas[i]
+            for m in range(l+1):
+                qlm[index_l+m+l] /= total_areas[i]
+                qlm[index_l-m+l] = (-1)**m*qlm[index_l+m+l].conjugate()
             index_l += 2*l+1
+        for c in range(len_array):
+            qlm_arrays[i, c] = qlm[c]
 
-    for i in range(len_array):
-        qlm_result[i] /= total_area
-
-    return qlm_result
-
-@numba.njit(numba.float64(numba.int64, numba.complex128[:], numba.int64, numba.complex128[:, :]))
-def calc_si(l, qlms, len_neigh, qlms_neigh):
-    """calculates the structural order parameter si from bond order parameters qlm
+@numba.njit([numba.float64[:](numba.int64, numba.int64, qlm_type[:, :], numba.int32[:], numba.int32[:], numba.int32[:])
+             for qlm_type in (numba.complex128, numba.complex64)], parallel=True, cache=True)
+def calc_si_arrays(l, index_l, qlm_arrays, point_list, indptr, neighbors):
+    """calculates the structural order parameter si from bond order parameters qlm for all points in point_list
 
+    qlm of l start at column index_l of qlm_arrays, neighbors of point i are neighbors[indptr[i]:indptr[i+1]].
+    The norms of all qlm vectors are computed once, entries of points not in point_list stay zero.
     More on this: https://doi.org/10.1103/PhysRevE.96.011301
     """
-    qlm_sum = 0.
-    for m in range(2*l+1):
-        qlm_sum += abs(qlms[m])**2
-    qlm_sum = sqrt(qlm_sum)
-
-    si = 0.
-    for i in range(len_neigh):
-        qlm_sum_neigh = 0.
-        for m in range(2*l+1):
-            qlm_sum_neigh += abs(qlms_neigh[i, m])**2
-        qlm_sum_neigh = sqrt(qlm_sum_neigh)
-        si_inner = 0.
+    n_points = qlm_arrays.shape[0]
+    qlm_norms = np.zeros(n_points, dtype=np.float64)
+    for i in numba.prange(n_points):
+        qlm_sum = 0.
         for m in range(2*l+1):
-            si_inner += (qlms[m]*qlms_neigh[i, m].conjugate()).real
-        si += si_inner/(qlm_sum*qlm_sum_neigh)
-
-    return si/len_neigh
-
-@numba.njit(numba.float64[:, :](numba.int32[:], numba.complex128[:, :]))
-def calc_qls_from_qlm_arrays(l_vec, qlm_arrays):
-    "calculates the final ql (over all m) from qlm data"
+            qlm_sum += abs(qlm_arrays[i, index_l+m])**2
+        qlm_norms[i] = sqrt(qlm_sum)
+
+    si_arr = np.zeros(n_points, dtype=np.float64)
+    for idx in numba.prange(point_list.shape[0]):
+        i = point_list[idx]
+        si = 0.
+        for k in range(indptr[i], indptr[i+1]):
+            j = neighbors[k]
+            si_inner = 0.
+            for m in range(2*l+1):
+                si_inner += (qlm_arrays[i, index_l+m]*qlm_arrays[j, index_l+m].conjugate()).real
+            si += si_inner/qlm_norms[j]
+        si_arr[i] = si/(qlm_norms[i]*(indptr[i+1]-indptr[i]))
+
+    return si_arr
+
+@numba.njit([numba.types.Tuple((numba.float64[:, :], numba.float64[:, :]))(
+    numba.int32[:], qlm_type[:, :], numba.int32[:], numba.float64[:], numba.int32[:, :], numba.int32[:])
+             for qlm_type in (numba.complex128, numba.complex64)], parallel=True, cache=True)
+def calc_qls_wls_from_qlm_arrays(l_vec, qlm_arrays, point_list, wigner_arr, m_arr, count_arr):
+    """calculates the final ql and wl (over all m) from qlm data for all points in point_list
+
+    The Wigner-3J symbols are expected in the symmetry reduced form of calc_wigner3j_reduced,
+    so wl is the weighted sum of the real parts of the unique qlm triple products.
+    """
     len_l = l_vec.shape[0]
-    result = np.zeros((qlm_arrays.shape[0], len_l), dtype=np.float64)
+    result_ql = np.zeros((point_list.shape[0], len_l), dtype=np.float64)
+    result_wl = np.zeros((point_list.shape[0], len_l), dtype=np.float64)
 
-    for i in range(qlm_arrays.shape[0]):
-        j = 0
-        m = 0
-        l = 0
+    for idx in numba.prange(point_list.shape[0]):
+        i = point_list[idx]
+        prevcount = 0
         index_l = 0
-        qlm_sum = 0.
         for j in range(len_l):
             l = l_vec[j]
             qlm_sum = 0.
-
             for m in range(-l, l+1):
                 qlm_sum += abs(qlm_arrays[i, index_l+m+l])**2
-            result[i, j] = sqrt(4.*pi/(2.*l+1)*qlm_sum)
+            result_ql[idx, j] = sqrt(4.*pi/(2.*l+1)*qlm_sum)
+
+            w = 0.
+            for k in range(prevcount, count_arr[j]):
+                w += wigner_arr[k]*(qlm_arrays[i, m_arr[k, 0]]*qlm_arrays[i, m_arr[k, 1]]*qlm_arrays[i, m_arr[k, 2]]).real
+            result_wl[idx, j] = w/qlm_sum**(3/2)
+            prevcount = count_arr[j]
             index_l += 2*l+1
 
-    return result
+    return result_ql, result_wl
 
-@numba.njit(numba.float64[:, :](numba.int32[:], numba.complex128[:, :], numba.float64[:], numba.int32[:, :], numba.int32[:]))
-def calc_wls_from_qlm_arrays(l_vec, qlm_arrays, wigner_arr, m_arr, count_arr):
-    "calculates the final ql (over all m) from qlm data"
-    len_l = l_vec.shape[0]
-    result = np.zeros((qlm_arrays.shape[0], len_l), dtype=np.float64)
+def calc_wigner3j_l(l):
+    """Wigner-3J symbols (l l l; m1 m2 m3) for all m1+m2+m3 == 0 using sympy
+
+    Returns the symbols and the m values of shape (n, 3) in the order of m1, m2.
+    """
+    from sympy.physics.wigner import wigner_3j
+    from sympy import N
 
-    for i in range(qlm_arrays.shape[0]):
+    wignerlist = []
+    mlist = []
+    for m1 in range(-l, l+1):
+        for m2 in range(-l, l+1):
+            m3 = -m1-m2
+            if -l <= m3 <= l:
+                wignerlist.append(float(N(wigner_3j(l, l, l, m1, m2, m3))))
+                mlist.append([m1, m2, m3])
+    return np.array(wignerlist, dtype=np.float64), np.array(mlist, dtype=np.int32).reshape(-1, 3)
+
+def generate_wigner3j_table(path=WIGNER3J_TABLE_PATH, lmax=12):
+    """precompute the Wigner-3J symbols for all l <= lmax and store them in an npz file"""
+    table = dict()
+    for l in range(lmax+1):
+        table['w{:d}'.format(l)], table['m{:d}'.format(l)] = calc_wigner3j_l(l)
+    np.savez_compressed(path, **table)
+
+def load_wigner3j_l(l):
+    """Wigner-3J symbols for a single l from memory, the precomputed table or sympy"""
+    if l not in wigner3j_l_cache:
+        key = 'w{:d}'.format(l)
+        if os.path.isfile(WIGNER3J_TABLE_PATH):
+            with np.load(WIGNER3J_TABLE_PATH) as table:
+                if key in table:
+                    wigner3j_l_cache[l] = (table[key], table['m{:d}'.format(l)])
+        if l not in wigner3j_l_cache:
+            wigner3j_l_cache[l] = calc_wigner3j_l(l)
+    return wigner3j_l_cache[l]
+
+def calc_wigner3j_general(l_vec):
+    """Cached computation of needed Wigner-3J symbols
+
+    The result is memoized per l_vec, the symbols are read from the table shipped
+    in WIGNER3J_TABLE_PATH and only computed with sympy if an l is missing there.
+    """
+    key = tuple(int(l) for l in l_vec)
+    if key not in wigner3j_cache:
+        wignerlist = []
+        mlist = []
+        index_l = 0
+        count = 0
+        countlist = []
+        for l in key:
+            wigner, m_values = load_wigner3j_l(l)
+            wignerlist.append(wigner)
+            mlist.append(m_values+index_l+l)
+            count += wigner.shape[0]
+            index_l += 2*l+1
+            countlist.append(count)
+        wigner3j_cache[key] = (np.concatenate(wignerlist).astype(np.float64),
+                               np.concatenate(mlist).astype(np.int32),
+                               np.array(countlist, dtype=np.int32))
+    return wigner3j_cache[key]
+
+def calc_wigner3j_reduced(l_vec):
+    """Cached symmetry reduced Wigner-3J symbols for the calculation of wl
+
+    (l l l; m1 m2 m3) qlm1 qlm2 qlm3 is invariant under permutations of (m1, m2, m3)
+    and the triple (-m1, -m2, -m3) gives the complex conjugate product, so only one
+    unordered triple per class is kept with the summed symbols as weight.
+    The real part of the weighted products sums up to wl, classes with zero weight
+    (all classes for odd l) are dropped.
+    """
+    key = tuple(int(l) for l in l_vec)
+    if key not in wigner3j_reduced_cache:
+        wigner_arr, m_arr, count_arr = calc_wigner3j_general(l_vec)
+        wignerlist = []
+        mlist = []
+        countlist = []
         prevcount = 0
         index_l = 0
-        for j in range(len_l):
-            l = l_vec[j]
-            w = 0.+0*1j
+        for j, l in enumerate(key):
+            weights = dict()
             for k in range(prevcount, count_arr[j]):
-                w += wigner_arr[k]*qlm_arrays[i][m_arr[k, 0]]*qlm_arrays[i][m_arr[k, 1]]*qlm_arrays[i][m_arr[k, 2]]
-
-            qlm_sum = 0
-            for m in range(-l, l+1):
-                qlm_sum += abs(qlm_arrays[i, index_l+m+l])**2
-            qlm_sum = qlm_sum**(3/2)
-            w = w/qlm_sum
-            result[i, j] = w.real
+                m_values = m_arr[k]-index_l-l
+                triple = tuple(sorted(m_values))
+                conj_triple = tuple(sorted(-m_values))
+                triple = min(triple, conj_triple)
+                weights[triple] = weights.get(triple, 0.)+wigner_arr[k]
+            for triple in sorted(weights):
+                if abs(weights[triple]) > 1e-12:
+                    wignerlist.append(weights[triple])
+                    mlist.append([m+index_l+l for m in triple])
+            countlist.append(len(wignerlist))
             prevcount = count_arr[j]
             index_l += 2*l+1
+        wigner3j_reduced_cache[key] = (np.array(wignerlist, dtype=np.float64),
+                                       np.array(mlist, dtype=np.int32).reshape(-1, 3),
+                                       np.array(countlist, dtype=np.int32))
+    return wigner3j_reduced_cache[key]
+
+@numba.njit(numba.int64(numba.float64, numba.float64[:]), nogil=True, cache=True)
+def find_bin(value, bin_edges):
+    """bisection for the histogram bin of value, -1 if value is out of bounds (same bins as np.histogram)"""
+    nbins = bin_edges.shape[0]-1
+    if not bin_edges[0] <= value <= bin_edges[nbins]:
+        return -1
+    lo = 0
+    hi = nbins-1
+    while lo < hi:
+        mid = (lo+hi+1) >> 1
+        if value < bin_edges[mid]:
+            hi = mid-1
+        else:
+            lo = mid
+    return lo
+
+@numba.njit(numba.int64(numba.float64, numba.float64, numba.float64, numba.int64), nogil=True, cache=True)
+def find_linear_bin(value, minval, maxval, nbins):
+    """find_bin for the bin edges np.linspace(minval, maxval, nbins+1) without creating them"""
+    if not minval <= value <= maxval:
+        return -1
+    step = (maxval-minval)/nbins
+    lo = 0
+    hi = nbins-1
+    while lo < hi:
+        mid = (lo+hi+1) >> 1
+        if value < minval+mid*step:
+            hi = mid-1
+        else:
+            lo = mid
+    return lo
+
+@numba.njit(numba.types.Tuple((numba.int32[:, :], numba.int32[:, :]))(
+    numba.int32[:], numba.int32[:], numba.int32[:], numba.float64[:, :], numba.float64[:], numba.float64[:],
+    numba.float64[:]), parallel=True, cache=True)
+def calc_bond_angle_distance_hists(indices, indptr, neighbors, datapoints, volumes, angle_edges, box_lengths):
+    """calculates bond angle and normalized distance histograms for all points in indices
+
+    Every pair of neighbors is visited once and binned into both histograms,
+    neighbors of point i are neighbors[indptr[i]:indptr[i+1]].
+    angle_edges are the bins of the cosine of the bond angles (usually ANGLE_EDGES),
+    distances follow the minimum image convention in periodic dimensions (box_lengths > 0).
+    Bond angles are defined in https://doi.org/10.1103/PhysRevB.73.054104,
+    distances are modified from https://doi.org/10.1103/PhysRevE.96.011301
+    """
+    nbins_angles = angle_edges.shape[0]-1
+    bond_angles = np.zeros((indices.shape[0], nbins_angles), dtype=np.int32)
+    hist_distances = np.zeros((indices.shape[0], NBINS_DISTANCES), dtype=np.int32)
 
-    return result
-
-def calc_wigner3j_general(l_vec):
-    """Cached computation of needed Wigner-3J symbols using sympy"""
-    wignerlist = []
-    mlist = []
-    index_l = 0
-    count = 0
-    countlist = []
-    for j in range(l_vec.shape[0]):
-        l = l_vec[j]
-        for m1 in range(-l, l+1):
-            for m2 in range(-l, l+1):
-                for m3 in range(-l, l+1):
-                    if m1+m2+m3 == 0:
-                        m1_new = index_l+m1+l
-                        m2_new = index_l+m2+l
-                        m3_new = index_l+m3+l
-                        wigner = float(N(wigner_3j(l, l, l, m1, m2, m3)))
-                        wignerlist.append(wigner)
-                        mlist.append([m1_new, m2_new, m3_new])
-                        count += 1
-        index_l += 2*l+1
-        countlist.append(count)
-    return np.array(wignerlist, dtype=np.float64), np.array(mlist, dtype=np.int32), np.array(countlist, dtype=np.int32)
-
-@numba.njit(numba.float64[:](numba.int32[:], numba.float64[:, :], numba.float64[:]))
-def calc_angles(neighbors, datapoints, centerpoint):
-    """jit compiled calculation of angles between neighbors"""
-    n_neighbors = len(neighbors)
-    angles = np.zeros((n_neighbors*(n_neighbors-1)//2), dtype=np.float64)
-    count = 0
-    for j in range(n_neighbors):
-        for k in range(j+1, n_neighbors):
-            idx1 = neighbors[j]
-            idx2 = neighbors[k]
-            numerator = 0.
-            sum_u = 0.
-            sum_v = 0.
-            for l in range(3):
-                u = datapoints[idx1, l]-centerpoint[l]
-                v = datapoints[idx2, l]-centerpoint[l]
-                numerator += u*v
-                sum_u += u**2
-                sum_v += v**2
-            angles[count] = numerator/(sqrt(sum_u*sum_v))
-            count += 1
-    return angles
-
-def calc_bond_angles(indices, neighborlist, datapoints):
-    """calculates bond angles for all points in indices"""
-    angle_edges = np.array([-1.05, -0.945, -0.915, -0.755, -0.195, 0.195, 0.245, 0.795, 1.05])
-    bond_angles = np.zeros((indices.shape[0], angle_edges.shape[0]-1), dtype=np.int32)
-
-    for idx in range(indices.shape[0]):
-        i = indices[idx]
-        angles = calc_angles(np.array(neighborlist[i], dtype=np.int32), datapoints, datapoints[i])
-        bond_angles[idx] = fast_hist(angles, angle_edges)
-    return bond_angles
-
-@numba.njit(numba.float64[:](numba.int32[:], numba.float64[:, :]))
-def calc_distances(neighbors, datapoints):
-    """jit compiled calculation of distances between neighbors"""
-    n_neighbors = len(neighbors)
-    distances = np.zeros((n_neighbors*(n_neighbors-1)//2), dtype=np.float64)
-    count = 0
-    for j in range(n_neighbors):
-        for k in range(j+1, n_neighbors):
-            idx1 = neighbors[j]
-            idx2 = neighbors[k]
-            normsq = 0.
-            for l in range(3):
-                normsq += (datapoints[idx1, l]-datapoints[idx2, l])**2
-            distances[count] = sqrt(normsq)
-            count += 1
-    return distances
-
-def calc_hist_distances(indices, neighborlist, datapoints, volumes):
-    """calculate distance histograms between neighbors for all points in indices"""
-    nbins_distances = 12
-    hist_distances = np.zeros((indices.shape[0], nbins_distances), dtype=np.int32)
-
-    for idx in range(indices.shape[0]):
+    for idx in numba.prange(indices.shape[0]):
         i = indices[idx]
         d0 = volumes[i]**(1/3)
-        distance_edges = fast_edges(d0*0.65, d0*3.1, nbins_distances+1)
-        distances = calc_distances(np.array(neighborlist[i], dtype=np.int32), datapoints)/d0
-        hist_distances[idx] = fast_hist(distances, distance_edges)
-    return hist_distances
-
-@numba.njit(numba.int32[:](numba.float64[:], numba.float64[:]))
-def fast_hist(data, bin_edges):
-    """jit compiled version of histogram"""
-    hist, _ = np.histogram(data, bin_edges)
-    return hist.astype(np.int32)
-
-@numba.njit(numba.float64[:](numba.float64, numba.float64, numba.int64))
-def fast_edges(minval, maxval, num_edges):
-    """jit compiled version of linspace"""
-    return np.linspace(minval, maxval, num_edges)
-
-@numba.njit(numba.float64[:](numba.float64, numba.float64[:], numba.float64[:, :]))
-def calc_minkowski_eigenvalues(total_area, voro_areas, normvecs):
-    """jit compiled calculation of rank 4 minkowski tensor W1(0,4)
+        dist_min = d0*DISTANCE_RANGE[0]
+        dist_max = d0*DISTANCE_RANGE[1]
+        for j in range(indptr[i], indptr[i+1]):
+            idx1 = neighbors[j]
+            for k in range(j+1, indptr[i+1]):
+                idx2 = neighbors[k]
+                numerator = 0.
+                sum_u = 0.
+                sum_v = 0.
+                normsq = 0.
+                for l in range(3):
+                    u = min_image(datapoints[idx1, l]-datapoints[i, l], box_lengths[l])
+                    v = min_image(datapoints[idx2, l]-datapoints[i, l], box_lengths[l])
+                    numerator += u*v
+                    sum_u += u**2
+                    sum_v += v**2
+                    normsq += min_image(datapoints[idx1, l]-datapoints[idx2, l], box_lengths[l])**2
+                angle_bin = find_bin(numerator/(sqrt(sum_u*sum_v)), angle_edges)
+                if angle_bin >= 0:
+                    bond_angles[idx, angle_bin] += 1
+                distance_bin = find_linear_bin(sqrt(normsq)/d0, dist_min, dist_max, NBINS_DISTANCES)
+                if distance_bin >= 0:
+                    hist_distances[idx, distance_bin] += 1
+    return bond_angles, hist_distances
+
+def calc_mandel_tables():
+    """index tables for the Mandel notation of a fully symmetric rank 4 tensor
+
+    Returns the exponents (px, py, pz) of its 15 independent components and for every
+    entry of the 6x6 Mandel matrix the index of its component and its weight.
+    """
+    voigt_pairs = [(0, 0), (1, 1), (2, 2), (1, 2), (0, 2), (0, 1)]
+    voigt_weights = [1., 1., 1., sqrt(2.), sqrt(2.), sqrt(2.)]
+    exponents = [(px, py, 4-px-py) for px in range(4, -1, -1) for py in range(4-px, -1, -1)]
+    components = np.zeros((6, 6), dtype=np.int64)
+    weights = np.zeros((6, 6), dtype=np.float64)
+    for a in range(6):
+        for b in range(6):
+            tensor_index = voigt_pairs[a]+voigt_pairs[b]
+            components[a, b] = exponents.index(tuple(tensor_index.count(d) for d in range(3)))
+            weights[a, b] = voigt_weights[a]*voigt_weights[b]
+    return np.array(exponents, dtype=np.int64), components, weights
+
+MANDEL_TABLES = calc_mandel_tables()
+
+@numba.njit([numba.float64[:, :, :](numba.int32[:], numba.int32[:], facet_type[:, :], facet_type[:], facet_type[:],
+                                    numba.int64[:, :], numba.int64[:, :], numba.float64[:, :])
+             for facet_type in (numba.float64, numba.float32)], parallel=True, cache=True)
+def calc_minkowski_tensors(point_list, indptr, facet_normals, facet_areas, total_areas,
+                           exponents, components, weights):
+    """jit compiled calculation of rank 4 minkowski tensors W1(0,4) for all points in point_list
+
+    Only the 15 independent components are accumulated, the tensors are returned
+    in Mandel notation (a version of Voigt notation), see calc_mandel_tables.
+    more on this in: https://doi.org/10.1103/PhysRevE.85.030301
+    """
+    n_comp = exponents.shape[0]
+    tensors = np.zeros((point_list.shape[0], 6, 6), dtype=np.float64)
+    for idx in numba.prange(point_list.shape[0]):
+        i = point_list[idx]
+        t = np.zeros(n_comp, dtype=np.float64)
+        powers = np.ones((3, 5), dtype=np.float64)
+        for f in range(indptr[i], indptr[i+1]):
+            for d in range(3):
+                for p in range(1, 5):
+                    powers[d, p] = powers[d, p-1]*facet_normals[f, d]
+            for c in range(n_comp):
+                t[c] += facet_areas[f]*powers[0, exponents[c, 0]]*powers[1, exponents[c, 1]]*powers[2, exponents[c, 2]]
+        for a in range(6):
+            for b in range(6):
+                tensors[idx, a, b] = weights[a, b]*t[components[a, b]]/total_areas[i]
+    return tensors
+
+def calc_minkowski_eigenvalues(point_list, indptr, facet_normals, facet_areas, total_areas):
+    """eigenvalues of the rank 4 minkowski tensors W1(0,4) for all points in point_list
     more on this in: https://doi.org/10.1103/PhysRevE.85.030301"""
-    tensor = np.zeros((6, 6), dtype=np.float64)
-    sqrt2 = 1.4142135623730951
-
-    t = np.zeros((3, 3, 3, 3), dtype=np.float64)
-    for f in range(voro_areas.shape[0]):
-        for i in range(3):
-            for j in range(3):
-                for k in range(3):
-                    for l in range(3):
-                        a = voro_areas[f]
-                        n = normvecs[f]
-                        t[i, j, k, l] += a*n[i]*n[j]*n[k]*n[l]
-    t /= total_area
-
-    #write the tensor in Mandel notation (a version of Voigt notation)
-    tensor[0, 0] = t[0, 0, 0, 0]
-    tensor[1, 0] = t[1, 1, 0, 0]
-    tensor[2, 0] = t[2, 2, 0, 0]
-    tensor[3, 0] = sqrt2*t[1, 2, 0, 0]
-    tensor[4, 0] = sqrt2*t[0, 2, 0, 0]
-    tensor[5, 0] = sqrt2*t[0, 1, 0, 0]
-
-    tensor[1, 1] = t[1, 1, 1, 1]
-    tensor[2, 1] = t[2, 2, 1, 1]
-    tensor[3, 1] += sqrt2*t[1, 2, 1, 1]
-    tensor[4, 1] += sqrt2*t[0, 2, 1, 1]
-    tensor[5, 1] += sqrt2*t[0, 1, 1, 1]
-
-    tensor[2, 2] += t[2, 2, 2, 2]
-    tensor[3, 2] += sqrt2*t[1, 2, 2, 2]
-    tensor[4, 2] += sqrt2*t[0, 2, 2, 2]
-    tensor[5, 2] += sqrt2*t[0, 1, 2, 2]
-
-    tensor[3, 3] += 2*t[1, 2, 1, 2]
-    tensor[4, 3] += 2*t[0, 2, 1, 2]
-    tensor[5, 3] += 2*t[0, 1, 1, 2]
-
-    tensor[4, 4] += 2*t[0, 2, 0, 2]
-    tensor[5, 4] += 2*t[0, 1, 0, 2]
-
-    tensor[5, 5] += 2*t[0, 1, 0, 1]
-
-    return np.linalg.eigvalsh(tensor)
+    tensors = calc_minkowski_tensors(point_list, indptr, facet_normals, facet_areas, total_areas,
+                                     *MANDEL_TABLES)
+    return np.linalg.eigvalsh(tensors)
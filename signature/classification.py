@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumPy forward pass of the pretrained MLP classifier, sklearn is only needed to convert pickles
+"""
+
+import os
+import pickle
+import numpy as np
+
+PRETRAINED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pretrained')
+
+class LegacyUnpickler(pickle.Unpickler):
+    """unpickler for estimators pickled with old sklearn versions
+    private modules that were moved (e.g. sklearn.preprocessing.data) are looked up in their parent package"""
+
+    def find_class(self, module, name):
+        try:
+            return super().find_class(module, name)
+        except ModuleNotFoundError:
+            if '.' not in module:
+                raise
+            return self.find_class(module.rsplit('.', 1)[0], name)
+
+def load_pickle(path):
+    "loads a pickled object, estimators of old sklearn versions included"
+    with open(path, 'rb') as file:
+        return LegacyUnpickler(file).load()
+
+def relu(x):
+    return np.maximum(x, 0., out=x)
+
+def tanh(x):
+    return np.tanh(x, out=x)
+
+def logistic(x):
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1.
+    return np.reciprocal(x, out=x)
+
+def identity(x):
+    return x
+
+ACTIVATIONS = {'relu': relu, 'tanh': tanh, 'logistic': logistic, 'identity': identity}
+
+class NumpyMLPClassifier:
+    """numpy forward pass of a fitted sklearn MLPClassifier
+    The StandardScaler of the training is folded into the first layer, so predict works
+    directly on the unscaled signature_matrix. Weights are stored in dtype (float32 by default),
+    sklearn is only needed to extract the weights (see from_sklearn, save and load)."""
+
+    def __init__(self, coefs, intercepts, classes, activation='relu', dtype=np.float32):
+        self.dtype = dtype
+        self.coefs = [np.ascontiguousarray(coef, dtype=dtype) for coef in coefs]
+        self.intercepts = [np.array(intercept, dtype=dtype) for intercept in intercepts]
+        self.classes = np.array(classes)
+        self.activation = activation
+
+    @classmethod
+    def from_sklearn(cls, classifier, scaler=None, dtype=np.float32):
+        """extract the weights of classifier and fold scaler (x-mean)/scale into the first layer"""
+        coefs = [np.array(coef, dtype=np.float64) for coef in classifier.coefs_]
+        intercepts = [np.array(intercept, dtype=np.float64) for intercept in classifier.intercepts_]
+        if scaler is not None:
+            scale = np.ones(coefs[0].shape[0]) if scaler.scale_ is None else scaler.scale_
+            mean = np.zeros(coefs[0].shape[0]) if scaler.mean_ is None else scaler.mean_
+            coefs[0] = coefs[0]/scale[:, np.newaxis]
+            intercepts[0] = intercepts[0]-mean@coefs[0]
+        return cls(coefs, intercepts, classifier.classes_, classifier.activation, dtype)
+
+    @classmethod
+    def from_pickles(cls, classifier_path, scaler_path=None, dtype=np.float32):
+        "load a pickled sklearn MLPClassifier and StandardScaler, see from_sklearn"
+        scaler = None if scaler_path is None else load_pickle(scaler_path)
+        return cls.from_sklearn(load_pickle(classifier_path), scaler, dtype)
+
+    def save(self, path):
+        "save the weights to a .npz file"
+        arrays = {'classes': self.classes, 'activation': np.array(self.activation)}
+        for layer, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            arrays['coef{:d}'.format(layer)] = coef
+            arrays['intercept{:d}'.format(layer)] = intercept
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path, dtype=np.float32):
+        "load weights saved with save"
+        with np.load(path) as arrays:
+            n_layers = len([key for key in arrays.files if key.startswith('coef')])
+            return cls([arrays['coef{:d}'.format(layer)] for layer in range(n_layers)],
+                       [arrays['intercept{:d}'.format(layer)] for layer in range(n_layers)],
+                       arrays['classes'], str(arrays['activation']), dtype)
+
+    def decision_function(self, matrix):
+        "output layer before the output activation (monotonic, so its argmax is the prediction)"
+        hidden = np.asarray(matrix, dtype=self.dtype)
+        for layer, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            hidden = hidden@coef
+            hidden += intercept
+            if layer < len(self.coefs)-1:
+                hidden = ACTIVATIONS[self.activation](hidden)
+        return hidden
+
+    def predict(self, matrix, batch_size=65536):
+        "predict the class of every row of matrix in batches of batch_size rows"
+        prediction = np.empty(matrix.shape[0], dtype=self.classes.dtype)
+        for start in range(0, matrix.shape[0], batch_size):
+            output = self.decision_function(matrix[start:start+batch_size])
+            if output.shape[1] == 1: #binary classification with a logistic output unit
+                prediction[start:start+batch_size] = self.classes[(output[:, 0] > 0).astype(np.int64)]
+            else:
+                prediction[start:start+batch_size] = self.classes[np.argmax(output, axis=1)]
+        return prediction
+
+pretrained_cache = dict()
+
+def load_pretrained(dtype=np.float32):
+    """the pretrained classifier of the pretrained directory (loaded once)
+    the weights are read from mlpclassifier.npz, the sklearn pickles are only a fallback"""
+    if dtype not in pretrained_cache:
+        npz_path = os.path.join(PRETRAINED_DIR, 'mlpclassifier.npz')
+        if os.path.exists(npz_path):
+            pretrained_cache[dtype] = NumpyMLPClassifier.load(npz_path, dtype)
+        else:
+            pretrained_cache[dtype] = NumpyMLPClassifier.from_pickles(os.path.join(PRETRAINED_DIR, 'mlpclassifier.pkl'),
+                                                                      os.path.join(PRETRAINED_DIR, 'standardscaler.pkl'),
+                                                                      dtype)
+    return pretrained_cache[dtype]
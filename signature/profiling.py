@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-stage profiling of MixedCrystalSignature: calls, wall time, peak memory and numba compilations
+"""
+
+import time
+import json
+import tracemalloc
+from numba.core import event
+
+class CompileCounter(event.Listener):
+    """counts numba compilations and their duration"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.
+        self.starts = []
+
+    def on_start(self, event):
+        self.count += 1
+        self.starts.append(time.perf_counter())
+
+    def on_end(self, event):
+        if self.starts:
+            self.seconds += time.perf_counter()-self.starts.pop()
+
+class StageProfiler:
+    """records calls, wall time and peak memory of calculation stages and counters of their results
+    see MixedCrystalSignature.profiling, the profile is a dict of built-in types (JSON serializable)"""
+
+    def __init__(self, trace_memory=False):
+        """trace_memory records the additional peak of traced (python and numpy) allocations
+        during every stage with tracemalloc, which slows down the calculation"""
+        self.trace_memory = trace_memory
+        self.stages = dict()
+        self.counters = dict()
+        self.compile_counter = CompileCounter()
+        self.started_tracing = False
+
+    def start(self):
+        "start listening to numba compilations (and tracing memory)"
+        event.register('numba:compile', self.compile_counter)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        "stop listening to numba compilations (and tracing memory)"
+        event.unregister('numba:compile', self.compile_counter)
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def add_stage(self, stage, seconds, peak_memory=None):
+        "add a call of stage to the profile"
+        record = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0., 'peak_memory_bytes': None})
+        record['calls'] += 1
+        record['seconds'] += seconds
+        if peak_memory is not None:
+            record['peak_memory_bytes'] = max(record['peak_memory_bytes'] or 0, peak_memory)
+
+    def run(self, stage, call):
+        "call call() and add it to the profile as stage, returns the result of the call"
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = call()
+        seconds = time.perf_counter()-start
+        peak_memory = tracemalloc.get_traced_memory()[1]-baseline if self.trace_memory else None
+        self.add_stage(stage, seconds, peak_memory)
+        return result
+
+    def as_dict(self):
+        "the profile: stages with calls, seconds and peak_memory_bytes, counters"
+        counters = dict(self.counters)
+        counters['numba_compilations'] = self.compile_counter.count
+        counters['numba_compile_seconds'] = self.compile_counter.seconds
+        return {'stages': {stage: dict(record) for stage, record in self.stages.items()},
+                'counters': counters}
+
+    def to_json(self, **kwargs):
+        "the profile as JSON string, kwargs are passed to json.dumps"
+        return json.dumps(self.as_dict(), **kwargs)
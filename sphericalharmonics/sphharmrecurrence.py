@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Spherical harmonics by recurrence of the normalized associated Legendre functions
+"""
+
+from math import sqrt, pi
+import numba
+
+@numba.njit(numba.int64(numba.int64, numba.int64), nogil=True, cache=True)
+def sph_harm_index(l, m):
+    """index of Y_lm (0 <= m <= l) in the array filled by sph_harm_recurrence"""
+    return l*(l+1)//2+m
+
+@numba.njit(numba.void(numba.int64, numba.float64, numba.float64, numba.float64, numba.complex128[:]), nogil=True, cache=True)
+def sph_harm_recurrence(lmax, x, y, z, ylm):
+    """spherical harmonics Y_lm for all 0 <= l <= lmax and 0 <= m <= l in the direction of the unit vector (x, y, z)
+
+    Y_lm is stored in ylm[sph_harm_index(l, m)], ylm needs (lmax+1)*(lmax+2)//2 entries.
+    Negative m follow from Y_l,-m = (-1)^m conj(Y_lm).
+    Uses the recurrence of the normalized associated Legendre functions (with Condon-Shortley phase),
+    so the result is identical to the sympy definition used in sph_harm_hard.
+    """
+    cos_theta = min(max(z, -1.), 1.)
+    sin_theta = sqrt(x*x+y*y)
+    if sin_theta > 0.:
+        eiphi = complex(x/sin_theta, y/sin_theta)
+    else:
+        eiphi = complex(1., 0.)
+
+    pmm = sqrt(1./(4.*pi))
+    eimphi = complex(1., 0.)
+    for m in range(lmax+1):
+        if m > 0:
+            pmm *= -sqrt((2.*m+1.)/(2.*m))*sin_theta
+            eimphi *= eiphi
+        ylm[sph_harm_index(m, m)] = pmm*eimphi
+        if m == lmax:
+            break
+        p_prev = pmm
+        p_cur = sqrt(2.*m+3.)*cos_theta*pmm
+        ylm[sph_harm_index(m+1, m)] = p_cur*eimphi
+        for l in range(m+2, lmax+1):
+            a_lm = sqrt((4.*l*l-1.)/(l*l-m*m))
+            b_lm = sqrt(((l-1.)*(l-1.)-m*m)/(4.*(l-1.)*(l-1.)-1.))
+            p_next = a_lm*(cos_theta*p_cur-b_lm*p_prev)
+            p_prev = p_cur
+            p_cur = p_next
+            ylm[sph_harm_index(l, m)] = p_cur*eimphi
+
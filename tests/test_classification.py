@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+import datageneration.generatecrystaldata as gcn
+import datageneration.disordercrystaldata as dcs
+import signature.classification as classification
+from crystalanalysis import CrystalAnalyzer
+from mixedcrystalsignature import MixedCrystalSignature
+
+STRUCTURES = {'fcc': gcn.fill_volume_fcc, 'bcc': gcn.fill_volume_bcc, 'hcp': gcn.fill_volume_hcp}
+
+@pytest.mark.parametrize('structure', sorted(STRUCTURES))
+@pytest.mark.parametrize('noise', [0.02, 0.05])
+def test_classify_artificial_crystals(structure, noise):
+    datapoints = dcs.add_gaussian_noise(STRUCTURES[structure](12, 12, 12), noise, 0)
+    sign_calculator = MixedCrystalSignature()
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_inner_volume([[2, 10]]*3)
+    sign_calculator.calc_signature()
+    labels = sign_calculator.classify()
+    assert labels.shape == (datapoints.shape[0],)
+    assert set(np.unique(labels)) <= {0}|set(CrystalAnalyzer.LABELS2STRUCT.values())
+    assert np.all(labels[sign_calculator.solid_indices] == CrystalAnalyzer.LABELS2STRUCT[structure])
+    assert np.all(np.delete(labels, sign_calculator.solid_indices) == 0)
+
+def test_predict_in_batches():
+    classifier = classification.load_pretrained()
+    matrix = np.random.default_rng(0).normal(size=(100, classifier.coefs[0].shape[0]))
+    assert np.array_equal(classifier.predict(matrix, batch_size=7), classifier.predict(matrix))
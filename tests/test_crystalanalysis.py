@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+
+import crystalanalysis
+from crystalanalysis import CrystalAnalyzer
+from mixedcrystalsignature import MixedCrystalSignature
+
+def make_analyzer(cache_dir, solid_thresh=0.55):
+    return CrystalAnalyzer(None, None, MixedCrystalSignature(solid_thresh=solid_thresh),
+                           noiselist=[0, 5], volume=[8, 8, 8], loglevel=0, cache_dir=str(cache_dir))
+
+def count_calculations(monkeypatch):
+    calculations = []
+    calc_artificial_signature = crystalanalysis.calc_artificial_signature
+    def counted(*args):
+        calculations.append(args[0])
+        return calc_artificial_signature(*args)
+    monkeypatch.setattr(crystalanalysis, 'calc_artificial_signature', counted)
+    return calculations
+
+def test_signature_cache(tmp_path, monkeypatch):
+    calculations = count_calculations(monkeypatch)
+    analyzer = make_analyzer(tmp_path)
+    analyzer.generate_train_signatures()
+    jobs = len(CrystalAnalyzer.STRUCTURES)*2
+    assert len(calculations) == jobs
+    assert len(os.listdir(tmp_path)) == jobs*len(CrystalAnalyzer.CACHE_FIELDS)
+
+    cached = make_analyzer(tmp_path)
+    cached.generate_train_signatures()
+    assert len(calculations) == jobs
+    for structure in CrystalAnalyzer.STRUCTURES:
+        for field in CrystalAnalyzer.CACHE_FIELDS:
+            for array, cached_array in zip(analyzer.train_signatures[structure][field],
+                                           cached.train_signatures[structure][field]):
+                assert np.array_equal(array, cached_array, equal_nan=True)
+
+    changed = make_analyzer(tmp_path, solid_thresh=0.6)
+    changed.generate_train_signatures()
+    assert len(calculations) == 2*jobs
+    assert len(os.listdir(tmp_path)) == 2*jobs*len(CrystalAnalyzer.CACHE_FIELDS)
@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+import datageneration.generatecrystaldata as gcn
+
+LATTICES = {'sc': gcn.fill_volume_sc, 'bcc': gcn.fill_volume_bcc, 'fcc': gcn.fill_volume_fcc,
+            'hcp': gcn.fill_volume_hcp, 'diamond': gcn.fill_volume_diamond}
+
+@pytest.mark.parametrize('lattice', sorted(LATTICES))
+@pytest.mark.parametrize('limits', [(12, 12, 12), (5.3, 6.1, 4.7)])
+def test_identity_rotation_is_unrotated(lattice, limits):
+    unrotated = LATTICES[lattice](*limits)
+    assert np.array_equal(LATTICES[lattice](*limits, rotation=np.eye(3)), unrotated)
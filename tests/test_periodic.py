@@ -0,0 +1,32 @@
+import numpy as np
+
+import datageneration.generatecrystaldata as gcn
+from mixedcrystalsignature import MixedCrystalSignature
+
+def periodic_fcc(cells):
+    """fcc crystal of cells**3 unit cells that is periodic in the box [[0, length]]*3"""
+    cell_indices = np.stack(np.meshgrid(*[np.arange(cells)]*3, indexing='ij'), axis=-1).reshape(-1, 3)
+    datapoints = (cell_indices[:, np.newaxis, :] + gcn.FCC_BASIS[np.newaxis]).reshape(-1, 3) @ gcn.FCC_CELL
+    return datapoints, cells*gcn.FCC_CELL[0, 0]
+
+def calc_periodic(datapoints, length):
+    sign_calculator = MixedCrystalSignature()
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_box([[0, length]]*3)
+    sign_calculator.calc_signature()
+    return sign_calculator
+
+def test_periodic_fcc():
+    datapoints, length = periodic_fcc(5)
+    sign_calculator = calc_periodic(datapoints, length)
+    assert np.isclose(np.sum(sign_calculator.voro_vols), length**3)
+    assert np.all(np.diff(sign_calculator.neighbor_indptr) == 12)
+    assert np.array_equal(sign_calculator.solid_indices, np.arange(datapoints.shape[0]))
+    assert np.all(sign_calculator.signature_matrix[:, sign_calculator.signature_slices['N']] == 12)
+
+def test_periodic_noisy_points_outside_of_the_box():
+    datapoints, length = periodic_fcc(5)
+    datapoints = datapoints + np.random.default_rng(0).normal(scale=0.05, size=datapoints.shape) - length/3
+    sign_calculator = calc_periodic(datapoints, length)
+    assert np.isclose(np.sum(sign_calculator.voro_vols), length**3)
+    assert np.all(sign_calculator.valid_bool)
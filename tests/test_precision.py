@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import datageneration.generatecrystaldata as gcn
+import datageneration.disordercrystaldata as dcs
+from mixedcrystalsignature import MixedCrystalSignature
+
+STRUCTURES = {'fcc': gcn.fill_volume_fcc, 'bcc': gcn.fill_volume_bcc, 'hcp': gcn.fill_volume_hcp}
+
+def calc_labels(datapoints, precision):
+    sign_calculator = MixedCrystalSignature(precision=precision)
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_inner_volume([[2, 10]]*3)
+    sign_calculator.calc_signature()
+    return sign_calculator, sign_calculator.classify()
+
+@pytest.mark.parametrize('structure', sorted(STRUCTURES))
+@pytest.mark.parametrize('noise', [0.02, 0.08, 0.14])
+def test_single_precision_agrees(structure, noise):
+    datapoints = dcs.add_gaussian_noise(STRUCTURES[structure](12, 12, 12), noise, 1)
+    double, double_labels = calc_labels(datapoints, 'double')
+    single, single_labels = calc_labels(datapoints, 'single')
+    assert single.qlm_arrays.dtype == np.complex64
+    assert single.signature_matrix.dtype == np.float32
+    assert np.array_equal(single.solid_indices, double.solid_indices)
+    assert np.array_equal(single_labels, double_labels)
+
+def test_single_precision_with_float32_datapoints():
+    datapoints = dcs.add_gaussian_noise(gcn.fill_volume_fcc(12, 12, 12), 0.05, 1)
+    double, double_labels = calc_labels(datapoints, 'double')
+    single, single_labels = calc_labels(datapoints.astype(np.float32), 'single')
+    assert single.datapoints.dtype == np.float64
+    assert np.array_equal(single.solid_indices, double.solid_indices)
+    assert np.array_equal(single_labels, double_labels)
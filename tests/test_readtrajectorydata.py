@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import datareading.readtrajectorydata as rtd
+
+BOX = np.array([[0., 4.], [-1., 5.], [2., 5.]])
+TYPES = ['Cu', 'Ni', 'Cu', 'Ni', 'Cu']
+
+def make_frames():
+    rng = np.random.default_rng(0)
+    return [BOX[:, 0]+rng.random((5, 3))*(BOX[:, 1]-BOX[:, 0]) for _ in range(2)]
+
+def write_xyz(path, frames):
+    with open(path, 'w') as file:
+        for frame in frames:
+            file.write('{}\n'.format(frame.shape[0]))
+            file.write('Lattice="{} 0 0 0 {} 0 0 0 {}" Origin="{} {} {}" pbc="T T T"\n'.format(
+                *(BOX[:, 1]-BOX[:, 0]), *BOX[:, 0]))
+            for particle_type, point in zip(TYPES, frame):
+                file.write('{} {:.17g} {:.17g} {:.17g} 0.5\n'.format(particle_type, *point))
+
+def write_lammps_dump(path, frames):
+    ids = np.array([3, 1, 5, 2, 4])
+    with open(path, 'w') as file:
+        for timestep, frame in zip((0, 100), frames):
+            file.write('ITEM: TIMESTEP\n{}\n'.format(timestep))
+            file.write('ITEM: NUMBER OF ATOMS\n{}\n'.format(frame.shape[0]))
+            file.write('ITEM: BOX BOUNDS pp pp pp\n')
+            for bounds in BOX:
+                file.write('{:.17g} {:.17g}\n'.format(*bounds))
+            file.write('ITEM: ATOMS id type x y z\n')
+            #particles are written out of id order
+            for particle_id, point in zip(ids, frame[ids-1]):
+                file.write('{} {} {:.17g} {:.17g} {:.17g}\n'.format(particle_id, particle_id % 2 + 1, *point))
+
+@pytest.mark.parametrize('fmt, name, writer', [('xyz', 'frames.xyz', write_xyz),
+                                               ('lammps', 'frames.dump', write_lammps_dump)])
+def test_read_trajectory(tmp_path, fmt, name, writer):
+    frames = make_frames()
+    path = str(tmp_path/name)
+    writer(path, frames)
+    read_frames = list(rtd.read_trajectory(path))
+    assert len(read_frames) == 2
+    for frame, (_, datapoints, box) in zip(frames, read_frames):
+        #the type column and extra columns are skipped
+        assert np.array_equal(datapoints, frame)
+        assert np.array_equal(box, BOX)
+    expected_index = {'xyz': [0, 1], 'lammps': [0, 100]}[fmt]
+    assert [index for index, _, _ in read_frames] == expected_index
+    assert [index for index, _, _ in rtd.read_trajectory(path, fmt, start=1)] == expected_index[1:]
+    assert [index for index, _, _ in rtd.read_trajectory(path, fmt, stop=1)] == expected_index[:1]
+    assert [index for index, _, _ in rtd.read_trajectory(path, fmt, step=2)] == expected_index[:1]
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+import datageneration.generatecrystaldata as gcn
+import datageneration.disordercrystaldata as dcs
+from mixedcrystalsignature import MixedCrystalSignature
+
+def make_calculator(datapoints, inner_volume):
+    sign_calculator = MixedCrystalSignature()
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_inner_volume(inner_volume)
+    return sign_calculator
+
+def assert_same_signature(sign_calculator, reference):
+    assert np.array_equal(sign_calculator.solid_indices, reference.solid_indices)
+    assert np.array_equal(sign_calculator.signature_matrix, reference.signature_matrix, equal_nan=True)
+    solids = reference.solid_indices
+    assert not np.any(np.isnan(sign_calculator.voro_vols[solids]))
+    assert np.array_equal(sign_calculator.voro_vols[solids], reference.voro_vols[solids])
+
+def test_signature_after_tiled_calculation():
+    datapoints = dcs.add_gaussian_noise(gcn.fill_volume_fcc(12, 12, 12), 0.05, 0)
+    sign_calculator = make_calculator(datapoints, [[3, 9]]*3)
+    sign_calculator.calc_signature()
+    sign_calculator.calc_signature_tiled((2, 2, 2))
+    sign_calculator.set_inner_volume([[2, 10]]*3)
+    sign_calculator.calc_signature()
+
+    reference = make_calculator(datapoints, [[2, 10]]*3)
+    reference.calc_signature()
+    assert_same_signature(sign_calculator, reference)
+
+def test_qlm_rows_kept_for_fewer_l():
+    datapoints = dcs.add_gaussian_noise(gcn.fill_volume_fcc(12, 12, 12), 0.05, 0)
+    sign_calculator = make_calculator(datapoints, [[3, 9]]*3)
+    sign_calculator.calc_signature()
+    calculated = sign_calculator.qlm_bool.copy()
+    qlm_rows = sign_calculator.qlm_arrays[calculated]
+    sign_calculator.set_inner_volume([[2, 10]]*3)
+    sign_calculator.calc_signature([])
+    assert np.array_equal(sign_calculator.qlm_l_vec, sign_calculator.L_VEC)
+    assert np.all(sign_calculator.qlm_bool[calculated])
+    assert np.array_equal(sign_calculator.qlm_arrays[calculated], qlm_rows)
+    sign_calculator.calc_signature()
+
+    reference = make_calculator(datapoints, [[2, 10]]*3)
+    reference.calc_signature()
+    assert_same_signature(sign_calculator, reference)
+
+def test_qlm_rows_of_other_l_order():
+    datapoints = dcs.add_gaussian_noise(gcn.fill_volume_fcc(12, 12, 12), 0.05, 0)
+    reference = make_calculator(datapoints, [[2, 10]]*3)
+    reference.calc_signature()
+
+    superset = make_calculator(datapoints, [[2, 10]]*3)
+    superset.calc_stages(['needed_cells', 'convex_hulls'])
+    superset.calc_qlm([2, 4, 5, 6])
+    superset.calc_signature()
+    assert np.array_equal(superset.qlm_l_vec, [2, 4, 5, 6])
+    assert_same_signature(superset, reference)
+
+    reordered = make_calculator(datapoints, [[2, 10]]*3)
+    reordered.calc_stages(['needed_cells', 'convex_hulls'])
+    reordered.calc_qlm([6, 5, 4])
+    reordered.calc_signature()
+    assert np.array_equal(reordered.qlm_l_vec, [6, 5, 4])
+    assert_same_signature(reordered, reference)
+
+@pytest.mark.parametrize('l_vec', [[4, 6], [4, 6, 8]])
+def test_load_state_of_other_l_vec(tmp_path, l_vec):
+    datapoints = dcs.add_gaussian_noise(gcn.fill_volume_fcc(12, 12, 12), 0.05, 0)
+    saved = make_calculator(datapoints, [[2, 10]]*3)
+    saved.save_state(tmp_path/'state.npz')
+
+    sign_calculator = MixedCrystalSignature(l_vec=l_vec)
+    sign_calculator.load_state(tmp_path/'state.npz')
+    sign_calculator.calc_signature()
+
+    reference = MixedCrystalSignature(l_vec=l_vec)
+    reference.set_datapoints(datapoints)
+    reference.set_inner_volume([[2, 10]]*3)
+    reference.calc_signature()
+    assert_same_signature(sign_calculator, reference)
+
+def assert_same_tiled_signature(sign_calculator, tiles):
+    sign_calculator.calc_signature()
+    reference_solids = sign_calculator.solid_indices.copy()
+    reference_signature = sign_calculator.signature_matrix.copy()
+    reference_vols = sign_calculator.voro_vols[reference_solids]
+    sign_calculator.calc_signature_tiled(tiles)
+    assert np.array_equal(sign_calculator.solid_indices, reference_solids)
+    assert np.allclose(sign_calculator.signature_matrix, reference_signature, equal_nan=True)
+    assert np.allclose(sign_calculator.voro_vols[reference_solids], reference_vols)
+
+def test_tiled_calculation_with_sparse_tiles():
+    cluster = dcs.add_gaussian_noise(gcn.fill_volume_fcc(8, 8, 8), 0.05, 0)
+    #two clusters and a single particle, most tiles are empty or hold less than 5 particles
+    datapoints = np.concatenate([cluster, cluster+40, [[20, 60, 20]]])
+    inner_bool = np.zeros(datapoints.shape[0], dtype=bool)
+    for offset in (0, 40):
+        inner_bool |= np.all((datapoints >= offset+2) & (datapoints <= offset+6), axis=1)
+    inner_bool[-1] = True
+    sign_calculator = MixedCrystalSignature()
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_inner_bool_vec(inner_bool)
+    assert_same_tiled_signature(sign_calculator, (3, 3, 3))
+
+def test_l_vec_without_6():
+    with pytest.raises(ValueError):
+        MixedCrystalSignature(l_vec=[4, 8])
+
+@pytest.mark.parametrize('tiles', [(2, 2, 2), (3, 2, 1)])
+def test_tiled_calculation_is_full_calculation(tiles):
+    datapoints = dcs.add_gaussian_noise(gcn.fill_volume_fcc(12, 12, 12), 0.05, 0)
+    sign_calculator = make_calculator(datapoints, [[2, 10]]*3)
+    assert_same_tiled_signature(sign_calculator, tiles)
+
+def test_tiled_calculation_in_periodic_box():
+    datapoints = dcs.add_gaussian_noise(gcn.fill_volume_fcc(12, 12, 12), 0.05, 0)
+    length = 6*gcn.FCC_CELL[0, 0]
+    datapoints = datapoints[np.all(datapoints < length-0.5, axis=1)]
+    sign_calculator = MixedCrystalSignature()
+    sign_calculator.set_datapoints(datapoints)
+    sign_calculator.set_box([[0, length]]*3)
+    assert_same_tiled_signature(sign_calculator, (2, 2, 2))
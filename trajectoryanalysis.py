@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Frame-by-frame analysis of trajectories with MixedCrystalSignature
+"""
+
+import os
+import time
+import threading
+import queue
+import numpy as np
+
+import datareading.readtrajectorydata as rtd
+
+class TrajectoryAnalyzer:
+    """helper class to analyze trajectories frame by frame
+    frames are read lazily in a background thread while the previous frame is calculated,
+    results are yielded or written per frame, so memory is bounded to a few frames"""
+
+    def __init__(self, sign_calculator, classifier=None, scaler=None, inner_distance=0,
+                 prefetch=1, loglevel=1):
+        """sign_calculator is a MixedCrystalSignature instance (its pool, l_vec etc. are used)
+        classifier and scaler optionally predict a label for every solid particle,
+        without scaler the classifier is expected to work on the unscaled signature_matrix
+        (e.g. signature.classification.NumpyMLPClassifier with the scaler folded in)
+        inner_distance is the distance from the bounding box of open frames
+        that is excluded from the inner volume, periodic frames are always fully inside
+        prefetch is the number of frames parsed ahead of the calculation"""
+        self.sign_calculator=sign_calculator
+        self.classifier=classifier
+        self.scaler=scaler
+        self.inner_distance=inner_distance
+        self.prefetch=prefetch
+        self.loglevel=loglevel
+
+    def prefetch_frames(self,frames):
+        """iterate over frames while the next frames are read in a background thread"""
+        frame_queue=queue.Queue(maxsize=self.prefetch)
+        stop_event=threading.Event()
+
+        def put(item):
+            #give up if the consumer stopped early
+            while not stop_event.is_set():
+                try:
+                    frame_queue.put(item,timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for frame in frames:
+                    if not put((True,frame)):
+                        return
+                put((False,None))
+            except Exception as error:
+                put((False,error))
+
+        producer=threading.Thread(target=produce,daemon=True)
+        producer.start()
+        try:
+            while True:
+                is_frame,frame=frame_queue.get()
+                if not is_frame:
+                    if frame is not None:
+                        raise frame
+                    return
+                yield frame
+        finally:
+            stop_event.set()
+            producer.join()
+
+    def get_inner_bool_vec(self,datapoints,box):
+        """inner volume of a frame: bounding box of the datapoints shrunk by inner_distance"""
+        if box is not None or self.inner_distance==0:
+            return np.ones(datapoints.shape[0],dtype=np.bool)
+        inner_min=np.min(datapoints,axis=0)+self.inner_distance
+        inner_max=np.max(datapoints,axis=0)-self.inner_distance
+        return np.all((datapoints>=inner_min)&(datapoints<=inner_max),axis=1)
+
+    def analyze_frame(self,index,datapoints,box=None):
+        """calculate signature (and labels) of a single frame
+        returns a dict with frame, struct_order, voro_vols, solid_indices, signature
+        (signature_matrix of the sign_calculator) and labels (0 for non solid particles)
+        if a classifier is provided"""
+        if self.loglevel >= 2:
+            t=time.time()
+        self.sign_calculator.set_datapoints(datapoints)
+        self.sign_calculator.set_box(box,self.sign_calculator.halo)
+        self.sign_calculator.set_inner_bool_vec(self.get_inner_bool_vec(datapoints,box))
+        self.sign_calculator.calc_signature()
+        result={'frame':index,
+                'struct_order':self.sign_calculator.struct_order,
+                'voro_vols':self.sign_calculator.voro_vols,
+                'solid_indices':self.sign_calculator.solid_indices,
+                'signature':self.sign_calculator.signature_matrix}
+        if self.classifier is not None:
+            if self.scaler is None:
+                result['labels']=self.sign_calculator.classify(self.classifier)
+            else:
+                labels=np.zeros(datapoints.shape[0],dtype=np.int32)
+                if len(result['solid_indices'])>0:
+                    labels[result['solid_indices']]=self.classifier.predict(self.scaler.transform(result['signature']))
+                result['labels']=labels
+        if self.loglevel >= 2:
+            print('frame:',index,'num:',datapoints.shape[0],
+                  'solid:',len(result['solid_indices']),'time:',time.time()-t)
+        return result
+
+    def iter_results(self,frames):
+        """calculate the results of all frames lazily, see analyze_frame
+        frames is an iterable of (index, datapoints, box), e.g. from datareading.readtrajectorydata"""
+        for index,datapoints,box in self.prefetch_frames(frames):
+            yield self.analyze_frame(index,datapoints,box)
+
+    def save_result(self,result,path):
+        """write the result of one frame to a compressed .npz file"""
+        np.savez_compressed(path,columns=np.array(self.sign_calculator.signature_columns),**result)
+
+    def analyze_trajectory(self,path,output_dir,fmt=None,start=0,stop=None,step=1):
+        """analyze the frames start:stop:step of a trajectory file (see read_trajectory)
+        and write the result of every frame to output_dir/frame_<index>.npz
+        as soon as it is calculated, returns the number of frames"""
+        os.makedirs(output_dir,exist_ok=True)
+        if self.loglevel >= 1:
+            print('analyzing trajectory',path)
+            t=time.time()
+        frames=rtd.read_trajectory(path,fmt=fmt,start=start,stop=stop,step=step)
+        n_frames=0
+        for result in self.iter_results(frames):
+            self.save_result(result,os.path.join(output_dir,'frame_{:08d}.npz'.format(result['frame'])))
+            n_frames+=1
+        if self.loglevel >= 1:
+            print('finished',n_frames,'frames, time:',time.time()-t)
+        return n_frames